@@ -4,20 +4,33 @@
 支持批量分析多个股票，生成智能洞察和投资建议
 """
 
+import asyncio
+import ctypes
+import functools
+import gc
+import gzip
+import hashlib
+import heapq
+import importlib.util
+import io
 import json
+import random
+import string
 import sys
 import os
+import platform
+import re
+import threading
 import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime, timedelta
-from typing import Dict, List, Any, Optional
-from dataclasses import dataclass, asdict
+from typing import Dict, List, Any, Literal, Optional, Tuple
+from dataclasses import dataclass, fields, is_dataclass
 import argparse
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
+import html
 
 # 添加项目根目录到Python路径
 project_root = Path(__file__).parent.parent
@@ -32,12 +45,255 @@ except ImportError:
     logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)s | %(message)s')
     logger = logging.getLogger('batch_stock_llm_analyzer')
 
-# LLM相关导入
+# 重量级依赖（openai、markdown、smtplib）只检测是否可用，
+# 真正用到时才导入，避免 --help 等命令行操作也要付出数百毫秒的导入开销
+OPENAI_AVAILABLE = importlib.util.find_spec('openai') is not None
+
+# Markdown解析器，用于生成邮件正文
+MARKDOWN_AVAILABLE = importlib.util.find_spec('markdown') is not None
+
+# 原先在模块顶层导入的名称，首次访问时才导入，保持 batch_stock_llm_analyzer.OpenAI 等用法可用
+_LAZY_IMPORTS = {
+    'OpenAI': ('openai', 'OpenAI'),
+    'smtplib': ('smtplib', None),
+    'MIMEText': ('email.mime.text', 'MIMEText'),
+    'MIMEMultipart': ('email.mime.multipart', 'MIMEMultipart'),
+    'MIMEBase': ('email.mime.base', 'MIMEBase'),
+    'encoders': ('email.encoders', None),
+}
+
+
+def __getattr__(name: str) -> Any:
+    """模块级延迟导入（PEP 562）"""
+    if name in _LAZY_IMPORTS and (name != 'OpenAI' or OPENAI_AVAILABLE):
+        module_name, attr = _LAZY_IMPORTS[name]
+        module = importlib.import_module(module_name)
+        value = getattr(module, attr) if attr else module
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# orjson序列化更快，未安装时回退到标准库json
 try:
-    from openai import OpenAI
-    OPENAI_AVAILABLE = True
+    import orjson
+    ORJSON_AVAILABLE = True
 except ImportError:
-    OPENAI_AVAILABLE = False
+    ORJSON_AVAILABLE = False
+
+# 邮件正文使用的Markdown扩展
+MARKDOWN_EXTENSIONS = ['tables', 'fenced_code', 'sane_lists', 'nl2br']
+
+# 汇总报告中展示的最高价格区间数量
+TOP_PRICE_RANGES = 5
+
+# 批量重试单次等待的上限（秒）
+MAX_RETRY_WAIT = 60
+
+# 本地/自建模型服务的默认并发较低，避免压垮推理服务
+LOCAL_LLM_PROVIDERS = ('custom_openai', 'ollama')
+
+# API限制错误关键字（可以重试）
+RATE_LIMIT_INDICATORS = (
+    "rate limit", "rate_limit", "too many requests", "429",
+    "quota exceeded", "quota_exceeded", "throttled",
+    "api limit", "api_limit", "request limit"
+)
+
+# 配额超限错误关键字（需要停止处理）
+QUOTA_EXCEEDED_INDICATORS = (
+    "quota exceeded", "quota_exceeded", "exceeded your current quota",
+    "limit: 200", "free_tier_requests"
+)
+
+# 关键字合并为一个预编译的正则，忽略大小写匹配，无需每次 lower() 后逐个查找
+_RATE_LIMIT_RE = re.compile('|'.join(map(re.escape, RATE_LIMIT_INDICATORS)), re.IGNORECASE)
+_QUOTA_EXCEEDED_RE = re.compile('|'.join(map(re.escape, QUOTA_EXCEEDED_INDICATORS)), re.IGNORECASE)
+
+# 错误类别：quota 配额超限（需要停止处理）、rate 限流和 network 网络错误（可以重试）、other 其他错误
+ErrorKind = Literal['quota', 'rate', 'network', 'other']
+
+# 股票代码格式
+_US_SYMBOL_RE = re.compile(r'^[A-Z]{1,5}$')
+_A_SHARE_SYMBOL_RE = re.compile(r'^\d{6}$')
+_HK_SYMBOL_RE = re.compile(r'^\d{4,5}(\.HK)?$')
+
+
+@functools.lru_cache(maxsize=None)
+def _retryable_llm_errors() -> tuple:
+    """可重试的LLM异常类型，首次调用时才导入openai"""
+    if OPENAI_AVAILABLE:
+        from openai import APIConnectionError, APITimeoutError, RateLimitError
+        return (RateLimitError, APIConnectionError, APITimeoutError, ConnectionError, TimeoutError)
+    return (ConnectionError, TimeoutError)
+
+
+def _classify_error(error_msg: str) -> ErrorKind:
+    """对错误信息分类，配额超限优先于限流（两类关键字有重叠）"""
+    if _QUOTA_EXCEEDED_RE.search(error_msg):
+        return 'quota'
+    if _RATE_LIMIT_RE.search(error_msg):
+        return 'rate'
+    return 'other'
+
+
+def _classify_exception(error: Exception) -> ErrorKind:
+    """对异常分类，错误信息无法识别时再按异常类型判断是否为网络错误"""
+    kind = _classify_error(str(error))
+    if kind == 'other' and isinstance(error, _retryable_llm_errors()):
+        return 'network'
+    return kind
+
+
+def _jittered_backoff(base: float, attempt: int) -> float:
+    """指数退避加随机抖动（0.5~1.5倍），避免并发失败的请求在同一时刻重试"""
+    return min(base * (2 ** attempt) * (0.5 + random.random()), MAX_RETRY_WAIT)
+
+
+class TAEncoder(json.JSONEncoder):
+    """分析结果JSON编码器：在写入时就地处理dataclass、消息对象和datetime，无需先复制整棵对象树"""
+    
+    def default(self, o):
+        if is_dataclass(o) and not isinstance(o, type):
+            # 浅层展开，字段值交给编码器继续处理
+            return {f.name: getattr(o, f.name) for f in fields(o)}
+        if hasattr(o, 'content') and hasattr(o, 'type'):
+            # 处理消息对象
+            return {
+                'type': getattr(o, 'type', 'unknown'),
+                'content': getattr(o, 'content', str(o))
+            }
+        if hasattr(o, 'isoformat'):
+            # 处理datetime对象
+            return o.isoformat()
+        # 处理其他对象
+        return str(o)
+
+
+_TA_ENCODER = TAEncoder()
+
+
+def write_json_file(path: Path, obj: Any, indent: bool = True):
+    """将对象写入JSON文件（UTF-8，不转义中文），优先使用orjson；.gz 后缀的文件使用gzip压缩"""
+    compress = str(path).endswith('.gz')
+    if ORJSON_AVAILABLE:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        data = orjson.dumps(obj, default=_TA_ENCODER.default, option=option)
+        if compress:
+            with gzip.open(path, 'wb') as f:
+                f.write(data)
+        else:
+            Path(path).write_bytes(data)
+    else:
+        opener = gzip.open if compress else open
+        with opener(path, 'wt', encoding='utf-8') as f:
+            json.dump(obj, f, cls=TAEncoder, ensure_ascii=False, indent=2 if indent else None)
+
+
+def write_json_stream(path: Path, obj: Any):
+    """
+    将dataclass或dict写成缩进JSON文件，列表字段逐项序列化后写入
+    
+    输出与 write_json_file 相同，但不会一次性生成整个文件的JSON字节串，
+    结果很多时峰值内存只与单个结果的大小相关。
+    """
+    if not ORJSON_AVAILABLE:
+        # json.dump 本身就是边编码边写入
+        write_json_file(path, obj)
+        return
+    
+    items = {f.name: getattr(obj, f.name) for f in fields(obj)} if is_dataclass(obj) else obj
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_INDENT_2
+    
+    def dumps(value: Any, depth: int) -> bytes:
+        # JSON字符串中的换行都已转义，直接替换换行符即可整体增加缩进
+        data = orjson.dumps(value, default=_TA_ENCODER.default, option=option)
+        return data.replace(b'\n', b'\n' + b'  ' * depth)
+    
+    with open(path, 'wb') as f:
+        if not items:
+            f.write(b'{}')
+            return
+        for i, (key, value) in enumerate(items.items()):
+            f.write(b',\n  ' if i else b'{\n  ')
+            f.write(orjson.dumps(str(key)) + b': ')
+            if isinstance(value, list) and value:
+                for j, item in enumerate(value):
+                    f.write(b',\n    ' if j else b'[\n    ')
+                    f.write(dumps(item, 2))
+                f.write(b'\n  ]')
+            else:
+                f.write(dumps(value, 1))
+        f.write(b'\n}')
+
+
+def dump_json_line(obj: Any) -> bytes:
+    """将对象序列化为单行JSON（NDJSON的一行，包含结尾换行符）"""
+    if ORJSON_AVAILABLE:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_APPEND_NEWLINE
+        return orjson.dumps(obj, default=_TA_ENCODER.default, option=option)
+    return (json.dumps(obj, cls=TAEncoder, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+def read_json_lines(path: Path) -> List[Any]:
+    """读取NDJSON文件，跳过空行和损坏的行（例如进程中断时写了一半的最后一行）"""
+    records = []
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                records.append(orjson.loads(line) if ORJSON_AVAILABLE else json.loads(line))
+            except ValueError:
+                logger.warning(f"⚠️ 跳过损坏的结果记录: {path}")
+    return records
+
+
+def read_json_file(path: Path) -> Any:
+    """读取JSON文件，优先使用orjson"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(Path(path).read_bytes())
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class TokenBucket:
+    """线程安全的令牌桶限流器"""
+    
+    def __init__(self, rate_per_min: float, capacity: Optional[float] = None):
+        """
+        Args:
+            rate_per_min: 每分钟补充的令牌数
+            capacity: 桶容量（允许的突发数量），默认等于每分钟令牌数
+        
+        Raises:
+            ValueError: 速率不为正数，或容量小于1（acquire 将永远无法获取令牌）
+        """
+        if not rate_per_min or rate_per_min <= 0:
+            raise ValueError(f"令牌桶速率必须为正数: {rate_per_min}")
+        self.rate = rate_per_min / 60.0
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate_per_min))
+        if self.capacity < 1:
+            raise ValueError(f"令牌桶容量不能小于1: {capacity}")
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self, tokens: float = 1.0) -> float:
+        """获取令牌，令牌不足时阻塞等待，返回等待的总秒数"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                wait_time = (tokens - self._tokens) / self.rate
+            time.sleep(wait_time)
+            waited += wait_time
 
 
 @dataclass
@@ -80,18 +336,224 @@ class BatchAnalysisResult:
     duration: float
 
 
+@dataclass(slots=True)
+class _BatchSettings:
+    """批量处理配置（analysis_options.batch_settings），未知字段忽略"""
+    max_concurrent: Optional[int] = None  # 默认使用分析器的 max_concurrency
+    delay_between_requests: float = 3
+    retry_failed: bool = True
+    max_retries: int = 3
+    memory_cleanup_interval: int = 10
+    api_rate_limit_detection: bool = True
+    adaptive_delay: bool = True
+    stop_on_quota_exceeded: bool = True
+    
+    @classmethod
+    def from_dict(cls, settings: Dict[str, Any]) -> '_BatchSettings':
+        known = {f.name for f in fields(cls)}
+        return cls(**{key: value for key, value in settings.items() if key in known})
+
+
+class InsightsCache:
+    """TradingAgents分析结果的本地文件缓存，按 (股票, 日期, 配置) 命中"""
+    
+    def __init__(self, cache_dir: Path, intraday_ttl_hours: float = 24,
+                 historical_ttl_days: float = 90):
+        """
+        Args:
+            cache_dir: 缓存目录
+            intraday_ttl_hours: 当日分析结果的有效期（小时）
+            historical_ttl_days: 历史日期分析结果的有效期（天）
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.intraday_ttl = intraday_ttl_hours * 3600
+        self.historical_ttl = historical_ttl_days * 86400
+    
+    @staticmethod
+    def make_key(**parts) -> str:
+        """根据分析参数生成缓存键"""
+        raw = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+        return hashlib.md5(raw.encode('utf-8')).hexdigest()
+    
+    def ttl_for(self, analysis_date: str) -> float:
+        """当日结果仍可能变化，使用较短有效期；历史日期结果使用较长有效期"""
+        if analysis_date >= datetime.now().strftime('%Y-%m-%d'):
+            return self.intraday_ttl
+        return self.historical_ttl
+    
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """读取未过期的缓存内容，不存在或已过期返回None"""
+        path = self._path(key)
+        if not path.exists():
+            return None
+        try:
+            entry = read_json_file(path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ 读取分析缓存失败 {path.name}: {e}")
+            return None
+        if time.time() - entry.get('timestamp', 0) > entry.get('ttl', 0):
+            return None
+        return entry.get('payload')
+    
+    def set(self, key: str, value: Dict[str, Any], ttl: Optional[float] = None):
+        """写入缓存（先写临时文件再替换，避免并发读到半个文件）"""
+        entry = {
+            'timestamp': time.time(),
+            'ttl': ttl if ttl is not None else self.intraday_ttl,
+            'payload': value
+        }
+        path = self._path(key)
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        try:
+            write_json_file(tmp_path, entry, indent=False)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"⚠️ 写入分析缓存失败 {path.name}: {e}")
+            tmp_path.unlink(missing_ok=True)
+
+
+class ConfigError(ValueError):
+    """LLM配置无效（缺少API密钥、端点不可用等），批量分析无法开始"""
+
+
+def _resolve_api_key(llm_config: Dict[str, Any]) -> Optional[str]:
+    """从配置文件或环境变量中获取API密钥"""
+    api_key = (llm_config.get('api_key') or '').strip()
+    if api_key:
+        return api_key
+    
+    api_key_env = llm_config.get('api_key_env', 'DEEPSEEK_API_KEY')
+    api_key = os.getenv(api_key_env)
+    if api_key:
+        logger.info(f"✅ 从环境变量 {api_key_env} 获取API密钥")
+    return api_key
+
+
+def _openai_compatible_endpoint(llm_config: Dict[str, Any]) -> Optional[Tuple[str, Optional[str]]]:
+    """
+    返回TradingAgentsGraph实际使用的 (OpenAI兼容端点, API密钥)
+    
+    端点和密钥环境变量的取值与 tradingagents/graph/trading_graph.py 创建LLM时保持一致；
+    google、anthropic 等使用各自SDK的提供商返回None。
+    """
+    provider = llm_config.get('llm_provider', 'openai').lower()
+    if provider in ('openai', 'siliconflow', 'openrouter'):
+        from tradingagents.default_config import DEFAULT_CONFIG
+        base_url = DEFAULT_CONFIG['backend_url']
+        key_envs = {
+            'openai': ('OPENAI_API_KEY',),
+            'siliconflow': ('SILICONFLOW_API_KEY',),
+            'openrouter': ('OPENROUTER_API_KEY', 'OPENAI_API_KEY'),
+        }[provider]
+    elif 'deepseek' in provider:
+        base_url = os.getenv('DEEPSEEK_BASE_URL', 'https://api.deepseek.com')
+        key_envs = ('DEEPSEEK_API_KEY',)
+    elif provider == 'custom_openai':
+        base_url = llm_config.get('custom_openai_base_url', 'http://localhost:28000/v1')
+        key_envs = ('CUSTOM_OPENAI_API_KEY',)
+    else:
+        return None
+    return base_url, next((os.getenv(name) for name in key_envs if os.getenv(name)), None)
+
+
+def _validate_config(llm_config: Dict[str, Any]) -> None:
+    """
+    预检LLM配置，在构建TradingAgents图（导入langchain等重量级模块）之前快速失败
+    
+    检查API密钥是否存在；OpenAI兼容的提供商再用5秒超时对图实际使用的端点和密钥调用
+    models.list()，确认端点可达且密钥有效。可通过 llm_config.preflight_check = false 跳过连通性检查。
+    
+    Raises:
+        ConfigError: 配置无效
+    """
+    api_key = _resolve_api_key(llm_config)
+    if not api_key:
+        raise ConfigError(
+            f"未找到有效的API密钥，请检查配置文件中的 api_key 字段或环境变量 "
+            f"{llm_config.get('api_key_env', 'DEEPSEEK_API_KEY')}"
+        )
+    
+    if not OPENAI_AVAILABLE or not llm_config.get('preflight_check', True):
+        return
+    endpoint = _openai_compatible_endpoint(llm_config)
+    if endpoint is None:
+        return
+    base_url, api_key = endpoint
+    if not api_key:
+        # 缺少提供商专用的密钥环境变量时，由创建TradingAgents图时报告具体错误
+        return
+    
+    from openai import OpenAI, APIConnectionError, AuthenticationError, OpenAIError
+    client = OpenAI(api_key=api_key, base_url=base_url, timeout=5, max_retries=0)
+    try:
+        client.models.list()
+    except AuthenticationError as e:
+        raise ConfigError(f"API密钥无效 ({base_url}): {e}") from e
+    except APIConnectionError as e:
+        raise ConfigError(f"无法连接LLM端点 {base_url}: {e}") from e
+    except OpenAIError as e:
+        # 部分兼容端点未实现 /models，能收到响应即说明端点可达
+        logger.debug(f"📋 LLM端点预检返回错误，忽略: {e}")
+    finally:
+        client.close()
+    logger.info(f"✅ LLM端点预检通过: {base_url}")
+
+
 class TradingAgentsAnalyzer:
     """使用TradingAgents现有分析师团队进行分析"""
     
-    def __init__(self, llm_config: Dict[str, Any]):
+    def __init__(self, llm_config: Dict[str, Any], cache: Optional[InsightsCache] = None,
+                 raw_state_dir: Optional[Path] = None):
+        """
+        Args:
+            llm_config: LLM配置
+            cache: 分析结果缓存，为None时不使用缓存
+            raw_state_dir: 原始状态保存目录，为None时不保存TradingAgents原始状态
+        
+        Raises:
+            ConfigError: LLM配置预检失败或TradingAgents图创建失败
+        """
         self.config = llm_config
         self.graph = None
+        self.cache = cache
+        self.raw_state_dir = Path(raw_state_dir) if raw_state_dir else None
+        self._cache_fingerprint = {}  # 影响分析结果的配置，参与缓存键计算
         self._analysis_count = 0  # 分析计数器
         self._last_cleanup = time.time()  # 上次清理时间
+        # analyze_stock 会在线程池中并发执行，计数器和清理时间需要加锁
+        self._state_lock = threading.Lock()
+        self.memory_cleanup_interval = 10  # 每分析多少次执行一次内存清理
+        self._malloc_trim = self._load_malloc_trim()
+        
+        # 最大并发分析数（同时在途的LLM请求数）
+        tradingagents_config = self.config.get('tradingagents', {})
+        provider = self.config.get('llm_provider', 'openai').lower()
+        default_concurrency = 2 if provider in LOCAL_LLM_PROVIDERS else 8
+        self.max_concurrency = max(1, int(tradingagents_config.get('max_concurrency', default_concurrency)))
+        
+        # 限流配置: rpm 为每分钟最多发起的 propagate 调用数
+        rate_limits = self.config.get('rate_limits', {})
+        rpm = rate_limits.get('rpm')
+        try:
+            self.rate_limiter = TokenBucket(rpm, rate_limits.get('burst')) if rpm is not None else None
+        except ValueError as e:
+            raise ConfigError(f"rate_limits 配置无效: {e}") from e
+        
+        _validate_config(self.config)
         self._initialize_graph()
     
     def _initialize_graph(self):
-        """初始化TradingAgents图"""
+        """
+        初始化TradingAgents图
+        
+        Raises:
+            ConfigError: 图创建失败（不支持的提供商、缺少依赖包、模型配置错误等），
+                此时没有任何股票能被分析，应直接停止而不是返回空的分析结果
+        """
         try:
             from tradingagents.graph.trading_graph import TradingAgentsGraph
             from tradingagents.default_config import DEFAULT_CONFIG
@@ -99,25 +561,10 @@ class TradingAgentsAnalyzer:
             # 创建配置
             config = DEFAULT_CONFIG.copy()
             
-            # 更新LLM配置
-            api_key = self.config.get('api_key', '').strip()
-            if not api_key:
-                # 从环境变量获取API密钥
-                api_key_env = self.config.get('api_key_env', 'DEEPSEEK_API_KEY')
-                api_key = os.getenv(api_key_env)
-                if api_key:
-                    logger.info(f"✅ 从环境变量 {api_key_env} 获取API密钥")
-            
-            if api_key :
-                config['api_key'] = api_key
-                logger.info(f"✅ API密钥已设置")
-            else:
-                logger.error(f"❌ 未找到有效的API密钥")
-                logger.error(f"   请检查以下配置:")
-                logger.error(f"   1. 配置文件中的 api_key 字段")
-                logger.error(f"   2. 环境变量 {self.config.get('api_key_env', 'DEEPSEEK_API_KEY')}")
-                logger.error(f"   3. 确保API密钥不是示例值 'sk-example'")
-                return
+            # 更新LLM配置（API密钥已在 _validate_config 中检查）
+            api_key = _resolve_api_key(self.config)
+            config['api_key'] = api_key
+            logger.info(f"✅ API密钥已设置")
             
             if self.config.get('base_url'):
                 config['base_url'] = self.config['base_url']
@@ -152,6 +599,14 @@ class TradingAgentsAnalyzer:
             selected_analysts = self._get_enabled_analysts(tradingagents_config)
             debug_mode = tradingagents_config.get('debug_mode', False)
             
+            self._cache_fingerprint = {
+                'llm_provider': config['llm_provider'],
+                'deep_think_llm': config.get('deep_think_llm'),
+                'research_depth': research_depth,
+                'analysts': sorted(selected_analysts),
+                'include_raw_state': self.raw_state_dir is not None,
+            }
+            
             # 初始化图
             self.graph = TradingAgentsGraph(
                 selected_analysts=selected_analysts,
@@ -168,62 +623,144 @@ class TradingAgentsAnalyzer:
             logger.info(f"  - 风险讨论轮次: {config.get('max_risk_discuss_rounds', 1)}")
             
         except Exception as e:
-            logger.error(f"❌ TradingAgents图初始化失败: {e}")
-            self.graph = None
+            raise ConfigError(f"TradingAgents图初始化失败: {e}") from e
     
     def analyze_stock(self, symbol: str, market_type: str, price_data: List[Dict], 
                      price_stats: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """使用TradingAgents分析单个股票"""
         if not self.graph:
-            return None
+            raise RuntimeError("TradingAgents图未初始化")
+        
+        # 使用当前日期作为分析日期
+        analysis_date = datetime.now().strftime('%Y-%m-%d')
+        
+        # 同一天、同一配置已分析过的股票直接使用缓存
+        cache_key = None
+        if self.cache:
+            cache_key = InsightsCache.make_key(
+                symbol=symbol, analysis_date=analysis_date, **self._cache_fingerprint
+            )
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"💾 命中分析缓存: {symbol} ({analysis_date})")
+                return cached
+        
+        logger.info(f"🤖 使用TradingAgents分析: {symbol} ({analysis_date})")
+        
+        # 运行TradingAgents分析
+        state, decision = self._propagate_rate_limited(symbol, analysis_date)
+        
+        # 提取分析结果
+        insights = self._extract_insights_from_state(state, decision)
+        
+        # 更新分析计数并定期清理内存
+        self._periodic_cleanup()
+        
+        state = state or {}
+        llm_insights = {
+            'insights': insights,
+            'model_used': 'TradingAgents',
+            'tokens_used': 0,  # TradingAgents内部管理token
+            'timestamp': datetime.now().isoformat(),
+            'data_period': state.get('data_period', {}),
+            'price_stats': state.get('price_stats', {}),
+            # 原始状态体积较大，只在启用时另存为压缩文件并记录路径
+            'raw_state_path': self._save_raw_state(symbol, analysis_date, state, decision)
+        }
+        
+        if cache_key:
+            self.cache.set(cache_key, llm_insights, ttl=self.cache.ttl_for(analysis_date))
+        
+        return llm_insights
+    
+    def _propagate_rate_limited(self, symbol: str, analysis_date: str):
+        """按令牌桶限流后调用 graph.propagate；失败重试由批量分析器统一处理"""
+        if self.rate_limiter:
+            waited = self.rate_limiter.acquire()
+            if waited:
+                logger.debug(f"⏳ 限流等待 {waited:.1f}s: {symbol}")
         
         try:
-            # 使用当前日期作为分析日期
-            analysis_date = datetime.now().strftime('%Y-%m-%d')
-            
-            logger.info(f"🤖 使用TradingAgents分析: {symbol} ({analysis_date})")
-            
-            # 运行TradingAgents分析
-            state, decision = self.graph.propagate(symbol, analysis_date)
-            
-            # 提取分析结果
-            insights = self._extract_insights_from_state(state, decision)
-            
-            # 更新分析计数
-            self._analysis_count += 1
-            
-            # 定期清理内存
-            self._periodic_cleanup()
-            
-            return {
-                'insights': insights,
-                'model_used': 'TradingAgents',
-                'tokens_used': 0,  # TradingAgents内部管理token
-                'timestamp': datetime.now().isoformat(),
-                'raw_state': self._make_serializable(state),
-                'raw_decision': self._make_serializable(decision)
-            }
-            
+            return self.graph.propagate(symbol, analysis_date)
         except Exception as e:
             logger.error(f"❌ TradingAgents分析失败 {symbol}: {e}")
+            raise
+    
+    def _save_raw_state(self, symbol: str, analysis_date: str,
+                        state: Dict, decision: Dict) -> Optional[str]:
+        """将TradingAgents原始状态保存为gzip压缩的JSON文件，返回文件路径"""
+        if not self.raw_state_dir:
+            return None
+        
+        raw_file = self.raw_state_dir / f"{symbol}_{analysis_date}.json.gz"
+        try:
+            self.raw_state_dir.mkdir(parents=True, exist_ok=True)
+            write_json_file(raw_file, {
+                # 直接交给编码器，不支持的类型由 TAEncoder.default 就地转换
+                'raw_state': state,
+                'raw_decision': decision
+            }, indent=False)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"⚠️ 保存原始状态失败 {symbol}: {e}")
+            return None
+        return str(raw_file)
+    
+    async def analyze_stock_async(self, symbol: str, market_type: str, price_data: List[Dict],
+                                  price_stats: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """在线程池中运行 analyze_stock，便于多个股票并发分析"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None,
+            functools.partial(self.analyze_stock, symbol, market_type, price_data, price_stats)
+        )
+    
+    @staticmethod
+    def _load_malloc_trim():
+        """获取glibc的 malloc_trim（仅Linux），用于把已释放的内存归还给操作系统"""
+        if platform.system() != 'Linux':
+            return None
+        try:
+            return ctypes.CDLL('libc.so.6').malloc_trim
+        except (OSError, AttributeError):
             return None
     
     def _periodic_cleanup(self):
-        """定期清理内存"""
-        current_time = time.time()
-        # 使用配置的清理间隔
-        cleanup_interval = getattr(self, 'memory_cleanup_interval', 10)
-        if (self._analysis_count % cleanup_interval == 0 or 
-            current_time - self._last_cleanup > 300):
-            
-            logger.debug(f"🧹 执行内存清理 (分析次数: {self._analysis_count})")
-            
-            # 强制垃圾回收
-            import gc
-            gc.collect()
-            
+        """
+        定期清理内存
+        
+        每 memory_cleanup_interval 次分析只回收年轻代对象（停顿短）；
+        每 10 倍间隔执行一次完整回收，并在Linux上调用 malloc_trim 归还空闲内存。
+        """
+        with self._state_lock:
+            self._analysis_count += 1
+            current_time = time.time()
+            # 使用配置的清理间隔
+            cleanup_interval = max(1, int(self.memory_cleanup_interval))
+            full_cleanup = self._analysis_count % (cleanup_interval * 10) == 0
+            if not (full_cleanup or self._analysis_count % cleanup_interval == 0 or 
+                    current_time - self._last_cleanup > 300):
+                return
             # 更新清理时间
             self._last_cleanup = current_time
+        
+        if not full_cleanup:
+            logger.debug(f"🧹 执行内存清理 (分析次数: {self._analysis_count}, 年轻代)")
+            gc.collect(1)
+            return
+        
+        traced_before = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+        
+        # 完整垃圾回收
+        collected = gc.collect()
+        if self._malloc_trim is not None:
+            self._malloc_trim(0)
+        
+        if traced_before is not None:
+            freed = traced_before - tracemalloc.get_traced_memory()[0]
+            logger.debug(f"🧹 执行完整内存清理 (分析次数: {self._analysis_count}, "
+                         f"回收对象: {collected}, 释放: {freed / 1024 / 1024:.1f}MB)")
+        else:
+            logger.debug(f"🧹 执行完整内存清理 (分析次数: {self._analysis_count}, 回收对象: {collected})")
     
     def _extract_insights_from_state(self, state: Dict, decision: Dict) -> str:
         """从TradingAgents状态中提取洞察"""
@@ -277,34 +814,6 @@ class TradingAgentsAnalyzer:
         
         return "\n".join(insights) if insights else "无分析结果"
     
-    def _make_serializable(self, obj):
-        """将对象转换为可JSON序列化的格式"""
-        if isinstance(obj, dict):
-            return {key: self._make_serializable(value) for key, value in obj.items()}
-        elif isinstance(obj, list):
-            return [self._make_serializable(item) for item in obj]
-        elif hasattr(obj, '__dict__'):
-            # 处理自定义对象
-            if hasattr(obj, 'content') and hasattr(obj, 'type'):
-                # 处理消息对象
-                return {
-                    'type': getattr(obj, 'type', 'unknown'),
-                    'content': getattr(obj, 'content', str(obj))
-                }
-            else:
-                # 处理其他对象
-                return str(obj)
-        elif hasattr(obj, 'isoformat'):
-            # 处理datetime对象
-            return obj.isoformat()
-        else:
-            # 处理基本类型
-            try:
-                json.dumps(obj)
-                return obj
-            except (TypeError, ValueError):
-                return str(obj)
-    
     def _apply_research_depth_config(self, config: Dict, research_depth: int):
         """根据研究深度调整配置"""
         if research_depth == 1:
@@ -356,6 +865,111 @@ class TradingAgentsAnalyzer:
         return tradingagents_config.get('selected_analysts', ["market", "fundamentals", "news"])
 
 
+# 各SMTP服务器上次连接成功的配置
+SMTP_STATE_FILE = project_root / '.cache' / 'smtp_working_config.json'
+
+
+# 邮件正文HTML模板（模块加载时解析一次）
+EMAIL_BODY_TEMPLATE = string.Template("""
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <style>
+        body { font-family: 'Microsoft YaHei', Arial, sans-serif; line-height: 1.6; color: #333; margin: 0; padding: 0; }
+        .header { background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 30px 20px; text-align: center; }
+        .header h1 { margin: 0; font-size: 28px; }
+        .header p { margin: 10px 0 0 0; font-size: 16px; opacity: 0.9; }
+        .content { padding: 20px; max-width: 900px; margin: 0 auto; }
+        .summary { background-color: #f8f9fa; padding: 20px; border-radius: 8px; margin: 20px 0; border-left: 4px solid #667eea; }
+        .stats { display: flex; justify-content: space-around; margin: 20px 0; flex-wrap: wrap; }
+        .stat-box { background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 20px; border-radius: 8px; text-align: center; flex: 1; margin: 5px; min-width: 120px; }
+        .stat-value { font-size: 32px; font-weight: bold; margin-bottom: 5px; }
+        .stat-label { font-size: 14px; opacity: 0.9; }
+        .stock-detail { background-color: #ffffff; border: 1px solid #e0e0e0; border-radius: 8px; padding: 20px; margin: 20px 0; box-shadow: 0 2px 4px rgba(0,0,0,0.1); }
+        .stock-detail h3 { color: #667eea; margin-top: 0; border-bottom: 2px solid #667eea; padding-bottom: 10px; }
+        .stock-info { margin-top: 15px; }
+        .price-stats { width: 100%; border-collapse: collapse; margin: 15px 0; }
+        .price-stats td { padding: 8px 12px; border-bottom: 1px solid #e0e0e0; }
+        .price-stats td:first-child { color: #666; width: 40%; }
+        .price-stats td:last-child { color: #333; font-weight: 500; }
+        .llm-analysis { background-color: #f8f9fa; padding: 15px; border-radius: 6px; margin-top: 15px; }
+        .llm-analysis h4 { color: #667eea; margin-top: 0; }
+        .analysis-content { color: #555; }
+        .analysis-content h1, .analysis-content h2, .analysis-content h3, .analysis-content h4 { color: #667eea; margin-top: 15px; }
+        .analysis-content ul { padding-left: 20px; }
+        .analysis-content li { margin: 5px 0; }
+        .analysis-content table { width: 100%; border-collapse: collapse; margin: 10px 0; }
+        .analysis-content table th, .analysis-content table td { padding: 8px; border: 1px solid #ddd; text-align: left; }
+        .analysis-content table th { background-color: #f0f0f0; font-weight: bold; }
+        .footer { text-align: center; padding: 20px; color: #666; font-size: 12px; background-color: #f8f9fa; margin-top: 30px; }
+        .error-box { background-color: #fff3cd; border: 1px solid #ffc107; padding: 15px; border-radius: 6px; margin: 10px 0; }
+        .error-box strong { color: #856404; }
+    </style>
+</head>
+<body>
+    <div class="header">
+        <h1>📊 批量股票分析报告</h1>
+        <p>分析日期: $analysis_date</p>
+    </div>
+    
+    <div class="content">
+        <div class="summary">
+            <h2>📈 分析概览</h2>
+            <div class="stats">
+                <div class="stat-box">
+                    <div class="stat-value">$total_symbols</div>
+                    <div class="stat-label">总股票数</div>
+                </div>
+                <div class="stat-box">
+                    <div class="stat-value">$successful_analyses</div>
+                    <div class="stat-label">成功分析</div>
+                </div>
+                <div class="stat-box">
+                    <div class="stat-value">$failed_analyses</div>
+                    <div class="stat-label">失败分析</div>
+                </div>
+                <div class="stat-box">
+                    <div class="stat-value">$success_rate%</div>
+                    <div class="stat-label">成功率</div>
+                </div>
+            </div>
+            <p><strong>分析耗时:</strong> $duration 秒</p>
+$market_distribution_html
+        </div>
+        
+        <div class="summary">
+            <h2>📋 详细分析结果</h2>
+$summary_html$stock_details_html$failed_html
+        </div>
+    </div>
+    
+    <div class="footer">
+        <p>此邮件由 TradingAgents-CN 自动生成</p>
+        <p>生成时间: $generated_at</p>
+        <p>分析结果已保存在服务器，可通过系统查看完整报告</p>
+    </div>
+</body>
+</html>
+""")
+
+
+@functools.lru_cache(maxsize=None)
+def _markdown_parser():
+    """Markdown解析器只创建一次，每次转换前 reset()"""
+    import markdown
+    return markdown.Markdown(extensions=MARKDOWN_EXTENSIONS)
+
+
+@functools.lru_cache(maxsize=128)
+def _render_markdown(markdown_text: str) -> str:
+    """将Markdown文本转换为HTML，相同内容（如重发的汇总报告）只解析一次"""
+    if not MARKDOWN_AVAILABLE:
+        # 未安装markdown时保留原始排版
+        return f'<pre style="white-space: pre-wrap;">{html.escape(markdown_text)}</pre>'
+    return _markdown_parser().reset().convert(markdown_text)
+
+
 class EmailSender:
     """邮件发送工具类"""
     
@@ -377,6 +991,8 @@ class EmailSender:
                 - use_ssl: 是否使用SSL
         """
         self.enabled = email_config.get('enabled', False)
+        self._smtp = None  # 复用的SMTP连接
+        self._working_config = None  # 上次连接成功的SMTP配置
         if not self.enabled:
             logger.info("📧 邮件发送功能未启用")
             return
@@ -429,97 +1045,129 @@ class EmailSender:
             self.enabled = False
             return
         
+        # SMTP连接配置只构建一次，上次成功的加密配置排在最前
+        self._smtp_configs = self._candidate_configs()
+        self._working_config = self._load_working_config()
+        if self._working_config:
+            self._promote_config(self._working_config)
+        
         logger.info(f"✅ 邮件发送器初始化成功")
         logger.info(f"  - SMTP服务器: {self.smtp_server}:{self.smtp_port}")
         logger.info(f"  - 发件人: {self.from_email}")
         logger.info(f"  - 收件人: {', '.join(self.to_emails)}")
     
-    def send_email(self, subject: str, body: str, attachments: List[Path] = None) -> bool:
+    def _candidate_configs(self) -> List[Dict[str, Any]]:
+        """获取SMTP连接配置列表（按优先级排序）"""
+        # 163邮箱的备用配置（按优先级排序）
+        if "163.com" in self.smtp_server:
+            return [
+                {"port": 465, "use_ssl": True, "use_tls": False, "name": "SSL(465)"},
+                {"port": 25, "use_ssl": False, "use_tls": False, "name": "无加密(25)"},
+                {"port": 587, "use_ssl": False, "use_tls": True, "name": "TLS(587)"},
+            ]
+        # 其他邮箱使用原始配置
+        return [{
+            "port": self.smtp_port,
+            "use_ssl": self.use_ssl,
+            "use_tls": self.use_tls,
+            "name": f"原始配置({self.smtp_port})"
+        }]
+    
+    @staticmethod
+    def _is_encrypted(config: Dict[str, Any]) -> bool:
+        """配置是否使用SSL或TLS加密连接"""
+        return bool(config['use_ssl'] or config['use_tls'])
+    
+    def _load_working_config(self) -> Optional[Dict[str, Any]]:
+        """读取该SMTP服务器上次连接成功的配置（只接受加密配置）"""
+        if not SMTP_STATE_FILE.exists():
+            return None
+        try:
+            saved = read_json_file(SMTP_STATE_FILE).get(self.smtp_server)
+        except (OSError, ValueError, AttributeError):
+            return None
+        for config in self._smtp_configs:
+            if saved and config['port'] == saved.get('port') and config['use_ssl'] == saved.get('use_ssl') \
+                    and config['use_tls'] == saved.get('use_tls') and self._is_encrypted(config):
+                return config
+        return None
+    
+    def _save_working_config(self, config: Dict[str, Any]):
         """
-        发送邮件（支持多端口重试）
+        按SMTP服务器记录连接成功的配置，下次运行直接使用
         
-        Args:
-            subject: 邮件主题
-            body: 邮件正文
-            attachments: 附件文件路径列表
+        未加密的配置不记录：一次SSL/TLS连接的偶发失败不应让之后每次都改用明文发送密码。
+        """
+        if not self._is_encrypted(config):
+            return
+        try:
+            state = read_json_file(SMTP_STATE_FILE) if SMTP_STATE_FILE.exists() else {}
+            state[self.smtp_server] = {
+                'port': config['port'], 'use_ssl': config['use_ssl'], 'use_tls': config['use_tls']
+            }
+            SMTP_STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
+            write_json_file(SMTP_STATE_FILE, state)
+        except (OSError, ValueError, AttributeError) as e:
+            logger.debug(f"📧 保存SMTP配置失败: {e}")
+    
+    def _promote_config(self, config: Dict[str, Any]):
+        """将指定配置移到尝试顺序的最前面"""
+        self._smtp_configs.remove(config)
+        self._smtp_configs.insert(0, config)
+    
+    def _open_connection(self, config: Dict[str, Any]) -> 'smtplib.SMTP':
+        """按指定配置建立SMTP连接并登录"""
+        import smtplib  # 连带导入ssl，只有真正发送邮件时才需要
         
-        Returns:
-            是否发送成功
+        if config['use_ssl']:
+            logger.debug(f"📧 使用SSL连接...")
+            server = smtplib.SMTP_SSL(self.smtp_server, config['port'], timeout=30)
+        else:
+            logger.debug(f"📧 使用普通连接...")
+            server = smtplib.SMTP(self.smtp_server, config['port'], timeout=30)
+        
+        try:
+            if config['use_tls'] and not config['use_ssl']:
+                logger.debug(f"📧 启用TLS...")
+                server.starttls()
+            
+            logger.debug(f"📧 尝试登录...")
+            server.login(self.smtp_username, self.smtp_password)
+            logger.debug(f"📧 登录成功")
+        except Exception:
+            server.close()
+            raise
+        
+        return server
+    
+    def _get_server(self) -> Optional['smtplib.SMTP']:
         """
-        if not self.enabled:
-            logger.debug("📧 邮件发送功能未启用，跳过发送")
-            return False
+        获取可用的SMTP连接
         
-        # 创建邮件消息
-        msg = MIMEMultipart()
-        msg['From'] = self.from_email
-        msg['To'] = ', '.join(self.to_emails)
-        msg['Subject'] = subject
+        已有连接通过 noop() 检查是否存活，失效时重新连接；
+        重新连接时从上次成功的配置开始尝试。
         
-        # 添加正文
-        msg.attach(MIMEText(body, 'html', 'utf-8'))
+        Raises:
+            smtplib.SMTPAuthenticationError: 认证失败（无需尝试其他配置）
+        """
+        import smtplib
         
-        # 添加附件
-        if attachments:
-            for attachment_path in attachments:
-                if attachment_path.exists():
-                    try:
-                        with open(attachment_path, 'rb') as f:
-                            part = MIMEBase('application', 'octet-stream')
-                            part.set_payload(f.read())
-                            encoders.encode_base64(part)
-                            part.add_header(
-                                'Content-Disposition',
-                                f'attachment; filename= {attachment_path.name}'
-                            )
-                            msg.attach(part)
-                            logger.info(f"📎 已添加附件: {attachment_path.name}")
-                    except Exception as e:
-                        logger.warning(f"⚠️ 添加附件失败 {attachment_path}: {e}")
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            logger.debug(f"📧 SMTP连接已失效，重新连接...")
+            self._discard_server()
         
-        # 163邮箱的备用配置（按优先级排序）
-        if "163.com" in self.smtp_server:
-            configs = [
-                {"port": 465, "use_ssl": True, "use_tls": False, "name": "SSL(465)"},
-                {"port": 25, "use_ssl": False, "use_tls": False, "name": "无加密(25)"},
-                {"port": 587, "use_ssl": False, "use_tls": True, "name": "TLS(587)"},
-            ]
-        else:
-            # 其他邮箱使用原始配置
-            configs = [{
-                "port": self.smtp_port,
-                "use_ssl": self.use_ssl,
-                "use_tls": self.use_tls,
-                "name": f"原始配置({self.smtp_port})"
-            }]
+        configs = list(self._smtp_configs)
         
         # 尝试不同的配置
         for config in configs:
             try:
-                logger.info(f"📧 正在发送邮件到 {', '.join(self.to_emails)}...")
                 logger.info(f"📧 尝试配置: {config['name']} - {self.smtp_server}:{config['port']}")
-                
-                if config['use_ssl']:
-                    logger.debug(f"📧 使用SSL连接...")
-                    server = smtplib.SMTP_SSL(self.smtp_server, config['port'], timeout=30)
-                else:
-                    logger.debug(f"📧 使用普通连接...")
-                    server = smtplib.SMTP(self.smtp_server, config['port'], timeout=30)
-                
-                if config['use_tls'] and not config['use_ssl']:
-                    logger.debug(f"📧 启用TLS...")
-                    server.starttls()
-                
-                logger.debug(f"📧 尝试登录...")
-                server.login(self.smtp_username, self.smtp_password)
-                logger.debug(f"📧 登录成功，发送邮件...")
-                
-                server.send_message(msg)
-                server.quit()
-                
-                logger.info(f"✅ 邮件发送成功 (使用配置: {config['name']})")
-                return True
-                
+                server = self._open_connection(config)
             except smtplib.SMTPAuthenticationError as e:
                 logger.error(f"❌ 认证失败 (配置: {config['name']}): {e}")
                 logger.error(f"   请检查:")
@@ -527,18 +1175,24 @@ class EmailSender:
                 logger.error(f"   2. SMTP密码/授权码是否正确")
                 logger.error(f"   3. 163邮箱需要使用授权码，不是普通密码")
                 logger.error(f"   4. 是否已开启SMTP服务")
-                # 认证错误不需要尝试其他配置
-                return False
+                raise
             except (smtplib.SMTPException, ConnectionError, OSError) as e:
-                error_msg = str(e)
-                logger.warning(f"⚠️ 连接失败 (配置: {config['name']}): {error_msg}")
+                logger.warning(f"⚠️ 连接失败 (配置: {config['name']}): {e}")
                 # 继续尝试下一个配置
                 continue
             except Exception as e:
-                error_msg = str(e)
-                logger.warning(f"⚠️ 发送失败 (配置: {config['name']}): {error_msg}")
+                logger.warning(f"⚠️ 连接失败 (配置: {config['name']}): {e}")
                 # 继续尝试下一个配置
                 continue
+            
+            self._smtp = server
+            if config is not self._working_config:
+                self._working_config = config
+                # 只提升加密配置，明文配置保持原有的回退位置
+                if self._is_encrypted(config):
+                    self._promote_config(config)
+                    self._save_working_config(config)
+            return server
         
         # 所有配置都失败
         logger.error(f"❌ 所有SMTP配置都失败，无法发送邮件")
@@ -550,11 +1204,130 @@ class EmailSender:
         logger.error(f"   2. 检查防火墙设置")
         logger.error(f"   3. 确认163邮箱已开启SMTP服务")
         logger.error(f"   4. 尝试手动测试SMTP连接")
-        return False
+        return None
+    
+    def _discard_server(self):
+        """丢弃当前SMTP连接"""
+        if self._smtp is not None:
+            try:
+                self._smtp.close()
+            except Exception:
+                pass
+            self._smtp = None
+    
+    def close(self):
+        """关闭复用的SMTP连接"""
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._discard_server()
+    
+    @staticmethod
+    def _read_attachments(attachments: List[Path]) -> Dict[str, bytes]:
+        """并行读取附件内容，返回 文件名 -> 字节内容（读取失败的附件会被跳过）"""
+        def read(attachment_path: Path) -> Optional[bytes]:
+            try:
+                return attachment_path.read_bytes()
+            except OSError as e:
+                logger.warning(f"⚠️ 添加附件失败 {attachment_path}: {e}")
+                return None
+        
+        paths = [path for path in attachments if path.exists()]
+        if len(paths) > 1:
+            with ThreadPoolExecutor(max_workers=min(len(paths), 8)) as executor:
+                contents = list(executor.map(read, paths))
+        else:
+            contents = [read(path) for path in paths]
+        return {path.name: data for path, data in zip(paths, contents) if data is not None}
+    
+    def _build_message(self, subject: str, body: str,
+                       attachments: Optional[Dict[str, bytes]] = None):
+        """用已读入内存的附件内容构建邮件消息，不做任何磁盘IO"""
+        from email.mime.text import MIMEText
+        from email.mime.multipart import MIMEMultipart
+        from email.mime.base import MIMEBase
+        from email import encoders
+        
+        # 创建邮件消息
+        msg = MIMEMultipart()
+        msg['From'] = self.from_email
+        msg['To'] = ', '.join(self.to_emails)
+        msg['Subject'] = subject
+        
+        # 添加正文
+        msg.attach(MIMEText(body, 'html', 'utf-8'))
+        
+        # 添加附件
+        for filename, payload in (attachments or {}).items():
+            part = MIMEBase('application', 'octet-stream')
+            part.set_payload(payload)
+            encoders.encode_base64(part)
+            part.add_header(
+                'Content-Disposition',
+                f'attachment; filename= {filename}'
+            )
+            msg.attach(part)
+            logger.info(f"📎 已添加附件: {filename}")
+        
+        return msg
+    
+    def send_email(self, subject: str, body: str, attachments: List[Path] = None) -> bool:
+        """
+        发送邮件（复用SMTP连接，首次连接支持多端口重试）
+        
+        附件在建立连接前一次性读入内存，发送期间不再有磁盘IO。
+        
+        Args:
+            subject: 邮件主题
+            body: 邮件正文
+            attachments: 附件文件路径列表
+        
+        Returns:
+            是否发送成功
+        """
+        if not self.enabled:
+            logger.debug("📧 邮件发送功能未启用，跳过发送")
+            return False
+        
+        import smtplib
+        
+        payloads = self._read_attachments(attachments) if attachments else None
+        msg = self._build_message(subject, body, payloads)
+        
+        logger.info(f"📧 正在发送邮件到 {', '.join(self.to_emails)}...")
+        try:
+            server = self._get_server()
+            if server is None:
+                return False
+            
+            try:
+                server.send_message(msg)
+            except smtplib.SMTPServerDisconnected:
+                # 健康检查后连接仍可能被服务器关闭，重连一次
+                logger.debug(f"📧 SMTP连接已断开，重新连接后重试...")
+                self._discard_server()
+                server = self._get_server()
+                if server is None:
+                    return False
+                server.send_message(msg)
+        except smtplib.SMTPAuthenticationError:
+            # 认证错误已在连接时记录
+            return False
+        except Exception as e:
+            logger.error(f"❌ 邮件发送失败 (配置: {self._working_config['name'] if self._working_config else 'N/A'}): {e}")
+            self._discard_server()
+            return False
+        
+        logger.info(f"✅ 邮件发送成功 (使用配置: {self._working_config['name']})")
+        return True
     
     def send_analysis_results(self, batch_result: BatchAnalysisResult, 
                              summary_file: Path = None, 
-                             json_file: Path = None) -> bool:
+                             json_file: Path = None,
+                             now: Optional[datetime] = None,
+                             failed_results: Optional[List[StockAnalysisResult]] = None) -> bool:
         """
         发送分析结果邮件（内容直接展示在邮件正文中，不发送附件）
         
@@ -562,6 +1335,8 @@ class EmailSender:
             batch_result: 批量分析结果
             summary_file: 汇总报告文件路径（用于读取内容）
             json_file: JSON数据文件路径（用于读取内容）
+            now: 报告生成时间，默认当前时间
+            failed_results: 失败的分析结果，默认从 batch_result.results 中筛选
         
         Returns:
             是否发送成功
@@ -587,7 +1362,8 @@ class EmailSender:
         
         # 生成HTML邮件正文
         body = self._generate_email_body(
-            batch_result, analysis_date, success_rate, summary_content
+            batch_result, analysis_date, success_rate, summary_content, now=now,
+            failed_results=failed_results
         )
         
         # 发送邮件（不发送附件）
@@ -597,61 +1373,17 @@ class EmailSender:
         """将Markdown文本转换为HTML"""
         if not markdown_text:
             return ""
-        
-        html = markdown_text
-        
-        # 转换标题
-        html = html.replace('# ', '<h1>').replace('\n# ', '</h1>\n<h1>')
-        html = html.replace('## ', '<h2>').replace('\n## ', '</h2>\n<h2>')
-        html = html.replace('### ', '<h3>').replace('\n### ', '</h3>\n<h3>')
-        html = html.replace('#### ', '<h4>').replace('\n#### ', '</h4>\n<h4>')
-        
-        # 转换粗体
-        html = html.replace('**', '<strong>').replace('**', '</strong>')
-        
-        # 转换列表
-        lines = html.split('\n')
-        in_list = False
-        result_lines = []
-        
-        for line in lines:
-            if line.strip().startswith('- ') or line.strip().startswith('* '):
-                if not in_list:
-                    result_lines.append('<ul>')
-                    in_list = True
-                content = line.strip()[2:]
-                result_lines.append(f'<li>{content}</li>')
-            elif line.strip().startswith('|') and '|' in line[1:]:
-                # 表格行
-                if not in_list:
-                    result_lines.append('</ul>' if in_list else '')
-                    in_list = False
-                cells = [cell.strip() for cell in line.split('|')[1:-1]]
-                if '---' in line or '---' in ''.join(cells):
-                    result_lines.append('<tr>' + ''.join([f'<th>{cell}</th>' for cell in cells]) + '</tr>')
-                else:
-                    result_lines.append('<tr>' + ''.join([f'<td>{cell}</td>' for cell in cells]) + '</tr>')
-            else:
-                if in_list:
-                    result_lines.append('</ul>')
-                    in_list = False
-                if line.strip():
-                    result_lines.append(f'<p>{line}</p>')
-                else:
-                    result_lines.append('<br>')
-        
-        if in_list:
-            result_lines.append('</ul>')
-        
-        return '\n'.join(result_lines)
+        return _render_markdown(markdown_text)
     
     def _generate_email_body(self, batch_result: BatchAnalysisResult, 
                              analysis_date: str, success_rate: float,
-                             summary_content: str = "") -> str:
+                             summary_content: str = "", now: Optional[datetime] = None,
+                             failed_results: Optional[List[StockAnalysisResult]] = None) -> str:
         """生成美观的HTML邮件正文"""
+        now = now or datetime.now()
         
         # 生成股票详细分析内容
-        stock_details_html = ""
+        stock_parts = []
         for result in batch_result.results:
             if result.error:
                 continue
@@ -662,172 +1394,97 @@ class EmailSender:
             except:
                 analysis_time = result.analysis_time
             
-            stock_html = f"""
+            stock_parts.append(f"""
             <div class="stock-detail">
-                <h3>📊 {result.symbol} ({result.market_type})</h3>
+                <h3>📊 {html.escape(result.symbol)} ({result.market_type})</h3>
                 <div class="stock-info">
                     <p><strong>分析时间:</strong> {analysis_time}</p>
-"""
+""")
             
             # 添加价格统计
             if result.price_stats:
-                stock_html += "<table class='price-stats'>\n"
+                stock_parts.append("<table class='price-stats'>\n")
                 for key, value in result.price_stats.items():
                     if isinstance(value, (int, float)):
                         if 'price' in key.lower():
-                            stock_html += f"<tr><td><strong>{key}</strong></td><td>{value:.2f}</td></tr>\n"
+                            stock_parts.append(f"<tr><td><strong>{key}</strong></td><td>{value:.2f}</td></tr>\n")
                         else:
-                            stock_html += f"<tr><td><strong>{key}</strong></td><td>{value:.4f}</td></tr>\n"
+                            stock_parts.append(f"<tr><td><strong>{key}</strong></td><td>{value:.4f}</td></tr>\n")
                     else:
-                        stock_html += f"<tr><td><strong>{key}</strong></td><td>{value}</td></tr>\n"
-                stock_html += "</table>\n"
+                        stock_parts.append(f"<tr><td><strong>{key}</strong></td><td>{html.escape(str(value))}</td></tr>\n")
+                stock_parts.append("</table>\n")
             
             # 添加TradingAgents分析结果
             if result.llm_insights and result.llm_insights.get('insights'):
                 insights = result.llm_insights.get('insights', '')
                 # 将Markdown格式的insights转换为HTML
                 insights_html = self._markdown_to_html(insights)
-                stock_html += f"""
+                stock_parts.append(f"""
                 <div class="llm-analysis">
                     <h4>🤖 TradingAgents 智能分析</h4>
                     <div class="analysis-content">
                         {insights_html}
                     </div>
                 </div>
-"""
+""")
             
-            stock_html += """
+            stock_parts.append("""
                 </div>
             </div>
-"""
-            stock_details_html += stock_html
+""")
+        stock_details_html = "".join(stock_parts)
         
-        # 生成完整HTML
-        body = f"""
-<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <style>
-        body {{ font-family: 'Microsoft YaHei', Arial, sans-serif; line-height: 1.6; color: #333; margin: 0; padding: 0; }}
-        .header {{ background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 30px 20px; text-align: center; }}
-        .header h1 {{ margin: 0; font-size: 28px; }}
-        .header p {{ margin: 10px 0 0 0; font-size: 16px; opacity: 0.9; }}
-        .content {{ padding: 20px; max-width: 900px; margin: 0 auto; }}
-        .summary {{ background-color: #f8f9fa; padding: 20px; border-radius: 8px; margin: 20px 0; border-left: 4px solid #667eea; }}
-        .stats {{ display: flex; justify-content: space-around; margin: 20px 0; flex-wrap: wrap; }}
-        .stat-box {{ background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 20px; border-radius: 8px; text-align: center; flex: 1; margin: 5px; min-width: 120px; }}
-        .stat-value {{ font-size: 32px; font-weight: bold; margin-bottom: 5px; }}
-        .stat-label {{ font-size: 14px; opacity: 0.9; }}
-        .stock-detail {{ background-color: #ffffff; border: 1px solid #e0e0e0; border-radius: 8px; padding: 20px; margin: 20px 0; box-shadow: 0 2px 4px rgba(0,0,0,0.1); }}
-        .stock-detail h3 {{ color: #667eea; margin-top: 0; border-bottom: 2px solid #667eea; padding-bottom: 10px; }}
-        .stock-info {{ margin-top: 15px; }}
-        .price-stats {{ width: 100%; border-collapse: collapse; margin: 15px 0; }}
-        .price-stats td {{ padding: 8px 12px; border-bottom: 1px solid #e0e0e0; }}
-        .price-stats td:first-child {{ color: #666; width: 40%; }}
-        .price-stats td:last-child {{ color: #333; font-weight: 500; }}
-        .llm-analysis {{ background-color: #f8f9fa; padding: 15px; border-radius: 6px; margin-top: 15px; }}
-        .llm-analysis h4 {{ color: #667eea; margin-top: 0; }}
-        .analysis-content {{ color: #555; }}
-        .analysis-content h1, .analysis-content h2, .analysis-content h3, .analysis-content h4 {{ color: #667eea; margin-top: 15px; }}
-        .analysis-content ul {{ padding-left: 20px; }}
-        .analysis-content li {{ margin: 5px 0; }}
-        .analysis-content table {{ width: 100%; border-collapse: collapse; margin: 10px 0; }}
-        .analysis-content table th, .analysis-content table td {{ padding: 8px; border: 1px solid #ddd; text-align: left; }}
-        .analysis-content table th {{ background-color: #f0f0f0; font-weight: bold; }}
-        .footer {{ text-align: center; padding: 20px; color: #666; font-size: 12px; background-color: #f8f9fa; margin-top: 30px; }}
-        .error-box {{ background-color: #fff3cd; border: 1px solid #ffc107; padding: 15px; border-radius: 6px; margin: 10px 0; }}
-        .error-box strong {{ color: #856404; }}
-    </style>
-</head>
-<body>
-    <div class="header">
-        <h1>📊 批量股票分析报告</h1>
-        <p>分析日期: {analysis_date}</p>
-    </div>
-    
-    <div class="content">
-        <div class="summary">
-            <h2>📈 分析概览</h2>
-            <div class="stats">
-                <div class="stat-box">
-                    <div class="stat-value">{batch_result.total_symbols}</div>
-                    <div class="stat-label">总股票数</div>
-                </div>
-                <div class="stat-box">
-                    <div class="stat-value">{batch_result.successful_analyses}</div>
-                    <div class="stat-label">成功分析</div>
-                </div>
-                <div class="stat-box">
-                    <div class="stat-value">{batch_result.failed_analyses}</div>
-                    <div class="stat-label">失败分析</div>
-                </div>
-                <div class="stat-box">
-                    <div class="stat-value">{success_rate:.1f}%</div>
-                    <div class="stat-label">成功率</div>
-                </div>
-            </div>
-            <p><strong>分析耗时:</strong> {batch_result.duration:.2f} 秒</p>
-"""
-        
-        # 添加市场分布
+        # 市场分布
+        market_parts = []
         if batch_result.summary.get('market_distribution'):
-            body += """
+            market_parts.append("""
             <h3>📊 市场分布</h3>
             <ul>
-"""
+""")
             for market, count in batch_result.summary.get('market_distribution', {}).items():
-                body += f"                <li><strong>{market}:</strong> {count} 只股票</li>\n"
-            body += "            </ul>\n"
-        
-        body += """
-        </div>
-        
-        <div class="summary">
-            <h2>📋 详细分析结果</h2>
-"""
+                market_parts.append(f"                <li><strong>{market}:</strong> {count} 只股票</li>\n")
+            market_parts.append("            </ul>\n")
+        market_distribution_html = "".join(market_parts)
         
-        # 添加汇总报告内容（如果存在）
+        # 汇总报告内容（如果存在）
+        summary_html = ""
         if summary_content:
-            summary_html = self._markdown_to_html(summary_content)
-            body += f"""
+            summary_html = f"""
             <div class="summary-content">
-                {summary_html}
+                {self._markdown_to_html(summary_content)}
             </div>
 """
         
-        # 添加每个股票的详细分析
-        if stock_details_html:
-            body += stock_details_html
-        
-        # 添加失败的分析
-        failed_stocks = [r for r in batch_result.results if r.error]
+        # 失败的分析
+        failed_parts = []
+        failed_stocks = failed_results if failed_results is not None else [r for r in batch_result.results if r.error]
         if failed_stocks:
-            body += """
+            failed_parts.append("""
             <div class="summary">
                 <h2>❌ 失败分析</h2>
-"""
+""")
             for result in failed_stocks:
-                body += f"""
+                failed_parts.append(f"""
                 <div class="error-box">
-                    <strong>{result.symbol}</strong> ({result.market_type}): {result.error}
+                    <strong>{html.escape(result.symbol)}</strong> ({result.market_type}): {html.escape(result.error)}
                 </div>
-"""
-            body += "            </div>\n"
-        
-        body += """
-        </div>
-    </div>
-    
-    <div class="footer">
-        <p>此邮件由 TradingAgents-CN 自动生成</p>
-        <p>生成时间: """ + datetime.now().strftime('%Y-%m-%d %H:%M:%S') + """</p>
-        <p>分析结果已保存在服务器，可通过系统查看完整报告</p>
-    </div>
-</body>
-</html>
-"""
-        return body
+""")
+            failed_parts.append("            </div>\n")
+        failed_html = "".join(failed_parts)
+        
+        return EMAIL_BODY_TEMPLATE.substitute(
+            analysis_date=analysis_date,
+            total_symbols=batch_result.total_symbols,
+            successful_analyses=batch_result.successful_analyses,
+            failed_analyses=batch_result.failed_analyses,
+            success_rate=f"{success_rate:.1f}",
+            duration=f"{batch_result.duration:.2f}",
+            market_distribution_html=market_distribution_html,
+            summary_html=summary_html,
+            stock_details_html=stock_details_html,
+            failed_html=failed_html,
+            generated_at=now.strftime('%Y-%m-%d %H:%M:%S')
+        )
 
 
 class BatchStockLLMAnalyzer:
@@ -835,20 +1492,55 @@ class BatchStockLLMAnalyzer:
     
     def __init__(self, config: StockAnalysisConfig):
         self.config = config
-        self.llm_analyzer = TradingAgentsAnalyzer(config.llm_config)
+        
+        # 分析结果缓存（可通过 analysis_options.cache.enabled 或 --no-cache 关闭）
+        cache_settings = config.analysis_options.get('cache', {})
+        insights_cache = None
+        if cache_settings.get('enabled', True):
+            insights_cache = InsightsCache(
+                cache_settings.get('cache_dir', project_root / '.cache' / 'llm_insights'),
+                intraday_ttl_hours=cache_settings.get('intraday_ttl_hours', 24),
+                historical_ttl_days=cache_settings.get('historical_ttl_days', 90)
+            )
+        
+        # TradingAgents原始状态默认不保存（体积大且很少使用）
+        raw_state_dir = None
+        if config.analysis_options.get('include_raw_state', False):
+            raw_state_dir = Path(config.output_dir) / 'raw'
+        
+        self.llm_analyzer = TradingAgentsAnalyzer(
+            config.llm_config, cache=insights_cache, raw_state_dir=raw_state_dir
+        )
         self.results = []
+        self.failed_results = []  # 分析完成时记录，避免生成报告时再筛选
+        # 汇总统计在每个结果完成时累加，_generate_summary 无需再遍历全部结果
+        self._stats = {
+            'total': 0,
+            'successful': 0,
+            'market_distribution': Counter(),
+            'vol_sum': 0.0,
+            'price_ranges': [],  # 最小堆，只保留最高价最高的 TOP_PRICE_RANGES 个
+        }
         
         # 批量处理配置
-        self.batch_settings = config.analysis_options.get('batch_settings', {})
-        self.max_concurrent = self.batch_settings.get('max_concurrent', 2)
-        self.delay_between_requests = self.batch_settings.get('delay_between_requests', 3)
-        self.retry_failed = self.batch_settings.get('retry_failed', True)
-        self.max_retries = self.batch_settings.get('max_retries', 3)
-        self.memory_cleanup_interval = self.batch_settings.get('memory_cleanup_interval', 10)
-        self.batch_delay_multiplier = self.batch_settings.get('batch_delay_multiplier', 2)
-        self.api_rate_limit_detection = self.batch_settings.get('api_rate_limit_detection', True)
-        self.adaptive_delay = self.batch_settings.get('adaptive_delay', True)
-        self.stop_on_quota_exceeded = self.batch_settings.get('stop_on_quota_exceeded', True)
+        self.bs = _BatchSettings.from_dict(config.analysis_options.get('batch_settings', {}))
+        if self.bs.max_concurrent is None:
+            self.bs.max_concurrent = self.llm_analyzer.max_concurrency
+        self.bs.max_concurrent = max(1, int(self.bs.max_concurrent))
+        self.resume = config.analysis_options.get('resume', False)
+        # 每完成一只股票就追加一行，进程中断后可通过 --resume 跳过已完成的股票
+        self.results_file = Path(config.output_dir) / 'results.ndjson'
+        self.llm_analyzer.memory_cleanup_interval = self.bs.memory_cleanup_interval
+        
+        # 未配置 rate_limits.rpm 时，把请求间隔换算为令牌桶速率：与原来的顺序执行一样，
+        # 平均每 delay 秒最多发起一次请求，只允许 max_concurrent 个请求突发；缓存命中不消耗令牌
+        if self.llm_analyzer.rate_limiter is None and self.bs.delay_between_requests > 0:
+            self.llm_analyzer.rate_limiter = TokenBucket(
+                60.0 / self.bs.delay_between_requests, capacity=self.bs.max_concurrent
+            )
+        
+        # 同一批次中正在分析的 (股票, 日期)，重复的股票直接等待首次分析的结果
+        self._inflight: Dict[tuple, asyncio.Future] = {}
         
         # 初始化邮件发送器
         # 邮件配置从email_config字段获取
@@ -860,64 +1552,107 @@ class BatchStockLLMAnalyzer:
     
     def run_batch_analysis(self) -> BatchAnalysisResult:
         """运行批量分析"""
+        try:
+            return asyncio.run(self._run_batch_analysis_async())
+        finally:
+            self.email_sender.close()
+    
+    async def _run_batch_analysis_async(self) -> BatchAnalysisResult:
+        """并发运行批量分析，通过信号量限制同时在途的分析数"""
         start_time = time.time()
-        logger.info(f"🚀 开始批量LLM股票分析: {len(self.config.symbols)} 只股票")
-        logger.info(f"📋 批量处理配置: 最大并发={self.max_concurrent}, 请求间隔={self.delay_between_requests}s")
+        total = len(self.config.symbols)
+        logger.info(f"🚀 开始批量LLM股票分析: {total} 只股票")
+        logger.info(f"📋 批量处理配置: 最大并发={self.bs.max_concurrent}, 请求间隔={self.bs.delay_between_requests}s")
         
-        successful = 0
-        failed = 0
+        semaphore = asyncio.Semaphore(self.bs.max_concurrent)
+        quota_exceeded = False
         
-        # 分批处理股票，控制并发数量
-        batch_size = min(self.max_concurrent, len(self.config.symbols))
-        symbol_batches = [self.config.symbols[i:i + batch_size] 
-                         for i in range(0, len(self.config.symbols), batch_size)]
+        # 默认线程池最多 min(32, CPU数+4) 个线程，可能小于 max_concurrent；
+        # 换成与并发数一致的线程池，asyncio.run 结束时会自动关闭
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=self.bs.max_concurrent, thread_name_prefix='stock-analysis')
+        )
+        completed = self._load_completed_results() if self.resume else {}
         
-        for batch_idx, symbol_batch in enumerate(symbol_batches, 1):
-            logger.info(f"📦 处理批次 {batch_idx}/{len(symbol_batches)}: {len(symbol_batch)} 只股票")
-            
-            for i, symbol in enumerate(symbol_batch, 1):
-                global_idx = (batch_idx - 1) * batch_size + i
-                logger.info(f"📊 分析股票 {global_idx}/{len(self.config.symbols)}: {symbol}")
+        async def analyze_limited(global_idx: int, symbol: str) -> StockAnalysisResult:
+            nonlocal quota_exceeded
+            async with semaphore:
+                if quota_exceeded:
+                    # 配额已超限，剩余股票不再处理
+                    return StockAnalysisResult(
+                        symbol=symbol,
+                        market_type="unknown",
+                        analysis_time=datetime.now().isoformat(),
+                        data_period={},
+                        price_stats={},
+                        error="配额超限，未处理"
+                    )
+                
+                logger.info(f"📊 分析股票 {global_idx}/{total}: {symbol}")
                 
                 # 重试机制
-                result = self._analyze_with_retry(symbol, global_idx)
+                result = await self._analyze_with_retry(symbol, global_idx)
                 
                 if result.error:
-                    failed += 1
                     logger.error(f"❌ 分析失败 {symbol}: {result.error}")
                     
                     # 检查是否是配额超限错误，如果是则停止处理
-                    if self.stop_on_quota_exceeded and self._is_quota_exceeded_error(result.error):
-                        logger.error(f"🛑 配额已超限，停止批量处理")
-                        logger.error(f"   已处理: {successful} 成功, {failed} 失败")
-                        logger.error(f"   剩余股票: {len(self.config.symbols) - global_idx} 只")
-                        # 为剩余股票创建占位结果
-                        for remaining_symbol in self.config.symbols[global_idx:]:
-                            self.results.append(StockAnalysisResult(
-                                symbol=remaining_symbol,
-                                market_type="unknown",
-                                analysis_time=datetime.now().isoformat(),
-                                data_period={},
-                                price_stats={},
-                                error="配额超限，未处理"
-                            ))
-                        break
+                    if self.bs.stop_on_quota_exceeded and _classify_error(result.error) == 'quota':
+                        if not quota_exceeded:
+                            logger.error(f"🛑 配额已超限，停止批量处理")
+                        quota_exceeded = True
+                        return result
                 else:
-                    successful += 1
                     logger.info(f"✅ 分析完成 {symbol}")
                 
-                self.results.append(result)
-                
-                # 添加延迟避免API限制
-                if i < len(symbol_batch):
-                    logger.debug(f"⏳ 等待 {self.delay_between_requests}s 避免API限制...")
-                    time.sleep(self.delay_between_requests)
+                return result
+        
+        async def analyze_bounded(global_idx: int, symbol: str) -> StockAnalysisResult:
+            if symbol in completed:
+                logger.info(f"⏭️ 股票 {symbol} 今日已分析完成，跳过 (--resume)")
+                return completed[symbol]
+            
+            # 重复的股票等待首次分析的结果，不再重复运行
+            key = (symbol, datetime.now().strftime('%Y-%m-%d'))
+            pending = self._inflight.get(key)
+            if pending is not None:
+                logger.info(f"♻️ 股票 {symbol} 在本批次中重复，复用第一次的分析结果")
+                return await asyncio.shield(pending)
             
-            # 批次间额外延迟
-            if batch_idx < len(symbol_batches):
-                batch_delay = self.delay_between_requests * self.batch_delay_multiplier
-                logger.info(f"⏳ 批次间等待 {batch_delay}s...")
-                time.sleep(batch_delay)
+            future = asyncio.get_running_loop().create_future()
+            self._inflight[key] = future
+            try:
+                result = await analyze_limited(global_idx, symbol)
+            except BaseException:
+                future.cancel()
+                raise
+            finally:
+                self._inflight.pop(key, None)
+            future.set_result(result)
+            
+            # 立即落盘，并发任务都在事件循环线程中写入，无需加锁
+            results_out.write(dump_json_line(result))
+            results_out.flush()
+            return result
+        
+        async def analyze_and_record(global_idx: int, symbol: str) -> StockAnalysisResult:
+            result = await analyze_bounded(global_idx, symbol)
+            self._record_result(global_idx, result)
+            return result
+        
+        with open(self.results_file, 'ab') as results_out:
+            results = await asyncio.gather(*[
+                analyze_and_record(global_idx, symbol)
+                for global_idx, symbol in enumerate(self.config.symbols, 1)
+            ])
+        self.results.extend(results)
+        
+        successful = sum(1 for r in results if not r.error)
+        failed = len(results) - successful
+        if quota_exceeded:
+            skipped = sum(1 for r in results if r.error == "配额超限，未处理")
+            logger.error(f"   已处理: {successful} 成功, {failed - skipped} 失败")
+            logger.error(f"   剩余股票: {skipped} 只")
         
         duration = time.time() - start_time
         
@@ -926,7 +1661,7 @@ class BatchStockLLMAnalyzer:
         
         batch_result = BatchAnalysisResult(
             timestamp=datetime.now().isoformat(),
-            total_symbols=len(self.config.symbols),
+            total_symbols=total,
             successful_analyses=successful,
             failed_analyses=failed,
             results=self.results,
@@ -942,122 +1677,92 @@ class BatchStockLLMAnalyzer:
         
         return batch_result
     
-    def _analyze_with_retry(self, symbol: str, global_idx: int) -> StockAnalysisResult:
-        """带重试机制的股票分析"""
-        last_error = None
+    def _load_completed_results(self) -> Dict[str, StockAnalysisResult]:
+        """从 results.ndjson 读取今天已成功分析的股票结果（用于 --resume）"""
+        if not self.results_file.exists():
+            return {}
+        
+        today = datetime.now().strftime('%Y-%m-%d')
+        names = [f.name for f in fields(StockAnalysisResult)]
+        completed = {}
+        for record in read_json_lines(self.results_file):
+            if record.get('error') or not str(record.get('analysis_time', '')).startswith(today):
+                continue
+            completed[record['symbol']] = StockAnalysisResult(**{name: record.get(name) for name in names})
         
-        for attempt in range(self.max_retries + 1):
-            try:
+        if completed:
+            logger.info(f"⏭️ 从 {self.results_file} 恢复 {len(completed)} 只今日已完成的股票")
+        return completed
+    
+    async def _analyze_with_retry(self, symbol: str, global_idx: int) -> StockAnalysisResult:
+        """
+        带重试机制的股票分析
+        
+        只有限流和网络错误会重试；配额超限立即返回，让批量处理停止；
+        其他错误重试也不会成功（且每次重试都是一次完整的多智能体分析），直接返回失败。
+        """
+        max_retries = self.bs.max_retries if self.bs.retry_failed else 0
+        
+        for attempt in range(max_retries + 1):
+            result, error_kind = await self._analyze_single_stock(symbol)
+            
+            # 如果成功，返回结果
+            if not result.error:
                 if attempt > 0:
-                    logger.info(f"🔄 重试分析 {symbol} (尝试 {attempt + 1}/{self.max_retries + 1})")
-                    # 重试前等待更长时间
-                    wait_time = self.delay_between_requests * (2 ** attempt)
-                    logger.info(f"⏳ 重试前等待 {wait_time}s...")
-                    time.sleep(wait_time)
-                
-                result = self._analyze_single_stock(symbol)
-                
-                # 如果成功，返回结果
-                if not result.error:
-                    if attempt > 0:
-                        logger.info(f"✅ 重试成功 {symbol}")
-                    return result
-                
-                # 记录错误但继续重试
-                last_error = result.error
-                logger.warning(f"⚠️ 分析失败 {symbol} (尝试 {attempt + 1}): {result.error}")
-                
-            except Exception as e:
-                last_error = str(e)
-                error_str = str(e)
-                logger.warning(f"⚠️ 分析异常 {symbol} (尝试 {attempt + 1}): {e}")
-                
-                # 检查是否是配额超限错误（需要停止处理）
-                if self._is_quota_exceeded_error(error_str):
-                    logger.error(f"🚫 检测到配额超限错误！已达到Google API每日200次请求限制")
-                    logger.error(f"   错误信息: {error_str}")
-                    logger.error(f"   解决方案:")
-                    logger.error(f"   1. 等待24小时后配额重置")
-                    logger.error(f"   2. 升级到Google AI付费计划以获得更高配额")
-                    logger.error(f"   3. 减少批量分析的股票数量")
-                    logger.error(f"   访问配额监控: https://ai.dev/usage?tab=rate-limit")
-                    # 返回特殊错误标记，让主循环知道需要停止
-                    return StockAnalysisResult(
-                        symbol=symbol,
-                        market_type="unknown",
-                        analysis_time=datetime.now().isoformat(),
-                        data_period={},
-                        price_stats={},
-                        error=f"配额超限: {error_str}"
-                    )
-                
-                # 检查是否是API限制错误（可以重试）
-                if self._is_rate_limit_error(error_str):
-                    logger.warning(f"🚫 检测到API限制错误，将延长等待时间")
-                    if attempt < self.max_retries:
-                        # API限制时等待更长时间
-                        wait_time = self.delay_between_requests * 5 * (2 ** attempt)
-                        logger.info(f"⏳ API限制等待 {wait_time}s...")
-                        time.sleep(wait_time)
-                elif attempt < self.max_retries:
-                    # 其他错误等待较短时间
-                    time.sleep(self.delay_between_requests)
-        
-        # 所有重试都失败
-        logger.error(f"❌ 分析最终失败 {symbol} (已重试 {self.max_retries} 次): {last_error}")
-        return StockAnalysisResult(
-            symbol=symbol,
-            market_type="unknown",
-            analysis_time=datetime.now().isoformat(),
-            data_period={},
-            price_stats={},
-            error=f"重试{self.max_retries}次后仍失败: {last_error}"
-        )
+                    logger.info(f"✅ 重试成功 {symbol}")
+                return result
+            
+            logger.warning(f"⚠️ 分析失败 {symbol} (尝试 {attempt + 1}): {result.error}")
+            
+            # 检查是否是配额超限错误（需要停止处理）
+            if error_kind == 'quota':
+                logger.error(f"🚫 检测到配额超限错误！已达到Google API每日200次请求限制")
+                logger.error(f"   错误信息: {result.error}")
+                logger.error(f"   解决方案:")
+                logger.error(f"   1. 等待24小时后配额重置")
+                logger.error(f"   2. 升级到Google AI付费计划以获得更高配额")
+                logger.error(f"   3. 减少批量分析的股票数量")
+                logger.error(f"   访问配额监控: https://ai.dev/usage?tab=rate-limit")
+                # 返回特殊错误标记，让主循环知道需要停止
+                result.error = f"配额超限: {result.error}"
+                return result
+            
+            if error_kind == 'other' or attempt >= max_retries:
+                break
+            
+            if error_kind == 'rate':
+                # API限制时等待更长时间
+                logger.warning(f"🚫 检测到API限制错误，将延长等待时间")
+                wait_time = _jittered_backoff(self.bs.delay_between_requests * 5, attempt)
+            else:
+                wait_time = _jittered_backoff(self.bs.delay_between_requests, attempt)
+            logger.info(f"⏳ {wait_time:.1f}s 后重试 {symbol} (尝试 {attempt + 2}/{max_retries + 1})")
+            await asyncio.sleep(wait_time)
+        
+        # 重试次数用尽或错误不可重试
+        logger.error(f"❌ 分析最终失败 {symbol} (已重试 {attempt} 次): {result.error}")
+        result.error = f"重试{attempt}次后仍失败: {result.error}"
+        return result
     
-    def _is_rate_limit_error(self, error_msg: str) -> bool:
-        """检查是否是API限制错误"""
-        rate_limit_indicators = [
-            "rate limit", "rate_limit", "too many requests", "429",
-            "quota exceeded", "quota_exceeded", "throttled",
-            "api limit", "api_limit", "request limit"
-        ]
-        error_lower = error_msg.lower()
-        return any(indicator in error_lower for indicator in rate_limit_indicators)
-    
-    def _is_quota_exceeded_error(self, error_msg: str) -> bool:
-        """检查是否是配额超限错误（需要停止处理）"""
-        quota_exceeded_indicators = [
-            "quota exceeded", "quota_exceeded", "exceeded your current quota",
-            "limit: 200", "free_tier_requests"
-        ]
-        error_lower = error_msg.lower()
-        return any(indicator in error_lower for indicator in quota_exceeded_indicators)
-    
-    def _analyze_single_stock(self, symbol: str) -> StockAnalysisResult:
-        """分析单个股票"""
+    async def _analyze_single_stock(self, symbol: str) -> Tuple[StockAnalysisResult, Optional[ErrorKind]]:
+        """分析单个股票，返回分析结果和错误类别（成功时为None）"""
         try:
             # 检测市场类型
             market_type = self._detect_market_type(symbol)
             
             # 使用TradingAgents进行完整分析
-            llm_insights = None
-            if self.llm_analyzer.graph:
-                logger.info(f"🤖 使用TradingAgents分析: {symbol}")
-                llm_insights = self.llm_analyzer.analyze_stock(
-                    symbol, market_type, [], {}  # TradingAgents会自己获取数据
-                )
+            logger.info(f"🤖 使用TradingAgents分析: {symbol}")
+            llm_insights = await self.llm_analyzer.analyze_stock_async(
+                symbol, market_type, [], {}  # TradingAgents会自己获取数据
+            )
             
             # 从TradingAgents结果中提取数据统计
             data_period = {}
             price_stats = {}
             
-            if llm_insights and llm_insights.get('raw_state'):
-                state = llm_insights['raw_state']
-                # 尝试从状态中提取数据信息
-                if 'data_period' in state:
-                    data_period = state['data_period']
-                if 'price_stats' in state:
-                    price_stats = state['price_stats']
+            if llm_insights:
+                data_period = llm_insights.get('data_period') or {}
+                price_stats = llm_insights.get('price_stats') or {}
             
             return StockAnalysisResult(
                 symbol=symbol,
@@ -1066,7 +1771,7 @@ class BatchStockLLMAnalyzer:
                 data_period=data_period,
                 price_stats=price_stats,
                 llm_insights=llm_insights
-            )
+            ), None
             
         except Exception as e:
             return StockAnalysisResult(
@@ -1076,99 +1781,89 @@ class BatchStockLLMAnalyzer:
                 data_period={},
                 price_stats={},
                 error=str(e)
-            )
+            ), _classify_exception(e)
     
     def _detect_market_type(self, symbol: str) -> str:
         """检测股票市场类型"""
-        import re
-        if re.match(r'^[A-Z]{1,5}$', symbol.upper()):
+        if _US_SYMBOL_RE.match(symbol.upper()):
             return "美股"
-        elif re.match(r'^\d{6}$', symbol):
+        elif _A_SHARE_SYMBOL_RE.match(symbol):
             return "A股"
-        elif re.match(r'^\d{4,5}(\.HK)?$', symbol.upper()):
+        elif _HK_SYMBOL_RE.match(symbol.upper()):
             return "港股"
         else:
             return "美股"  # 默认美股
     
+    def _record_result(self, global_idx: int, result: StockAnalysisResult):
+        """将完成的分析结果累加到汇总统计中"""
+        stats = self._stats
+        stats['total'] += 1
+        if result.error:
+            self.failed_results.append(result)
+            return
+        
+        stats['successful'] += 1
+        stats['market_distribution'][result.market_type] += 1
+        stats['vol_sum'] += result.price_stats.get('price_volatility', 0)
+        
+        price_range = result.price_stats.get('price_range', {})
+        if price_range:
+            # 最高价相同时按股票在列表中的顺序排列
+            entry = (price_range.get('max', 0), -global_idx, {
+                'symbol': result.symbol,
+                'min': price_range.get('min', 0),
+                'max': price_range.get('max', 0)
+            })
+            if len(stats['price_ranges']) < TOP_PRICE_RANGES:
+                heapq.heappush(stats['price_ranges'], entry)
+            else:
+                heapq.heappushpop(stats['price_ranges'], entry)
+    
     def _generate_summary(self) -> Dict[str, Any]:
         """生成汇总分析"""
-        successful_results = [r for r in self.results if not r.error]
+        stats = self._stats
+        successful = stats['successful']
         
-        if not successful_results:
+        if not successful:
             return {"error": "没有成功的分析结果"}
         
-        # 统计信息
-        market_distribution = {}
-        avg_volatility = 0
-        price_ranges = []
-        
-        for result in successful_results:
-            # 市场分布
-            market = result.market_type
-            market_distribution[market] = market_distribution.get(market, 0) + 1
-            
-            # 波动率统计
-            volatility = result.price_stats.get('price_volatility', 0)
-            avg_volatility += volatility
-            
-            # 价格区间
-            price_range = result.price_stats.get('price_range', {})
-            if price_range:
-                price_ranges.append({
-                    'symbol': result.symbol,
-                    'min': price_range.get('min', 0),
-                    'max': price_range.get('max', 0)
-                })
-        
-        avg_volatility /= len(successful_results)
-        
-        # 排序价格区间
-        price_ranges.sort(key=lambda x: x['max'], reverse=True)
+        top_price_ranges = [entry[2] for entry in sorted(stats['price_ranges'], reverse=True)]
         
         return {
-            'market_distribution': market_distribution,
-            'average_volatility': avg_volatility,
-            'top_price_ranges': price_ranges[:5],  # 前5个最高价格区间
-            'total_analyzed': len(successful_results),
-            'analysis_success_rate': len(successful_results) / len(self.results) * 100
+            'market_distribution': dict(stats['market_distribution']),
+            'average_volatility': stats['vol_sum'] / successful,
+            'top_price_ranges': top_price_ranges,  # 最高价格区间排行
+            'total_analyzed': successful,
+            'analysis_success_rate': successful / stats['total'] * 100
         }
     
     def _save_results(self, batch_result: BatchAnalysisResult):
         """保存分析结果"""
         # 创建按日期分组的文件夹结构
-        analysis_date = datetime.now().strftime('%Y-%m-%d')
-        date_folder = Path(self.config.output_dir) / analysis_date
+        now = datetime.now()
+        time_tag = now.strftime('%H%M%S')
+        date_folder = Path(self.config.output_dir) / now.strftime('%Y-%m-%d')
         date_folder.mkdir(parents=True, exist_ok=True)
         
         # 保存批量分析的JSON结果
-        json_file = date_folder / f"batch_analysis_{datetime.now().strftime('%H%M%S')}.json"
-        serializable_result = self._make_serializable(asdict(batch_result))
+        json_file = date_folder / f"batch_analysis_{time_tag}.json"
         
-        with open(json_file, 'w', encoding='utf-8') as f:
-            json.dump(serializable_result, f, ensure_ascii=False, indent=2)
+        # 逐个结果写入文件，由编码器处理不可序列化的对象
+        write_json_stream(json_file, batch_result)
         
-        # 为每个股票创建单独的Markdown文件
-        individual_files = []
-        for result in batch_result.results:
-            if not result.error:
-                # 创建股票分析文件夹
-                stock_folder = date_folder / f"{result.symbol}_{result.market_type}"
-                stock_folder.mkdir(exist_ok=True)
-                
-                # 生成单个股票的Markdown报告
-                markdown_content = self._generate_individual_stock_markdown(result)
-                markdown_file = stock_folder / f"{result.symbol}_analysis.md"
-                
-                with open(markdown_file, 'w', encoding='utf-8') as f:
-                    f.write(markdown_content)
-                
-                individual_files.append(markdown_file)
-                logger.info(f"📄 股票分析已保存: {markdown_file}")
+        # 为每个股票创建单独的Markdown文件（同一批次中重复的股票只写一次）
+        successful_results = [r for r in batch_result.results if not r.error]
+        stock_reports = {
+            date_folder / f"{result.symbol}_{result.market_type}" / f"{result.symbol}_analysis.md":
+                self._generate_individual_stock_markdown(result, now=now)
+            for result in successful_results
+        }
+        individual_files = self._write_stock_reports(stock_reports)
         
         # 生成批量分析汇总报告
-        summary_file = date_folder / f"batch_summary_{datetime.now().strftime('%H%M%S')}.md"
+        summary_file = date_folder / f"batch_summary_{time_tag}.md"
         with open(summary_file, 'w', encoding='utf-8') as f:
-            f.write(self._generate_batch_summary_markdown(batch_result))
+            f.write(self._generate_batch_summary_markdown(batch_result, now))
         
         logger.info(f"📄 批量分析结果已保存到: {date_folder}")
         logger.info(f"  - 汇总报告: {summary_file}")
@@ -1181,16 +1876,35 @@ class BatchStockLLMAnalyzer:
             email_success = self.email_sender.send_analysis_results(
                 batch_result=batch_result,
                 summary_file=summary_file,
-                json_file=json_file
+                json_file=json_file,
+                now=now,
+                failed_results=self.failed_results
             )
             if email_success:
                 logger.info(f"✅ 邮件通知已发送")
             else:
                 logger.warning(f"⚠️ 邮件发送失败，但分析结果已保存")
     
+    @staticmethod
+    def _write_stock_report(markdown_file: Path, markdown_content: str) -> Path:
+        """写入单个股票的Markdown报告（股票文件夹不存在时创建）"""
+        markdown_file.parent.mkdir(exist_ok=True)
+        markdown_file.write_text(markdown_content, encoding='utf-8')
+        logger.info(f"📄 股票分析已保存: {markdown_file}")
+        return markdown_file
+    
+    def _write_stock_reports(self, stock_reports: Dict[Path, str]) -> List[Path]:
+        """写入各股票的Markdown报告，多个文件时用线程池并发写入"""
+        if len(stock_reports) <= 1:
+            return [self._write_stock_report(path, content) for path, content in stock_reports.items()]
+        
+        with ThreadPoolExecutor(max_workers=min(8, len(stock_reports)), thread_name_prefix='report-writer') as executor:
+            return list(executor.map(self._write_stock_report, stock_reports.keys(), stock_reports.values()))
+    
     def _generate_text_report(self, batch_result: BatchAnalysisResult) -> str:
         """生成文本报告"""
-        report = f"""
+        buf = io.StringIO()
+        buf.write(f"""
 # 批量LLM股票分析报告
 
 ## 分析概览
@@ -1202,33 +1916,33 @@ class BatchStockLLMAnalyzer:
 - 分析耗时: {batch_result.duration:.2f} 秒
 
 ## 市场分布
-"""
+""")
         
         for market, count in batch_result.summary.get('market_distribution', {}).items():
-            report += f"- {market}: {count} 只股票\n"
+            buf.write(f"- {market}: {count} 只股票\n")
         
-        report += f"""
+        buf.write(f"""
 ## 市场统计
 - 平均波动率: {batch_result.summary.get('average_volatility', 0):.4f}
 - 分析成功率: {batch_result.summary.get('analysis_success_rate', 0):.1f}%
 
 ## 详细分析结果
-"""
+""")
         
         for result in batch_result.results:
-            report += f"""
+            buf.write(f"""
 ### {result.symbol} ({result.market_type})
 - 分析时间: {result.analysis_time}
 - 数据期间: {result.data_period.get('start', 'N/A')} 至 {result.data_period.get('end', 'N/A')}
 - 平均价格: {result.price_stats.get('avg_price', 0):.2f}
 - 价格波动率: {result.price_stats.get('price_volatility', 0):.4f}
 - 价格区间: {result.price_stats.get('price_range', {}).get('min', 0):.2f} - {result.price_stats.get('price_range', {}).get('max', 0):.2f}
-"""
+""")
             
             if result.error:
-                report += f"- ❌ 错误: {result.error}\n"
+                buf.write(f"- ❌ 错误: {result.error}\n")
             elif result.llm_insights:
-                report += f"""
+                buf.write(f"""
 #### 🤖 TradingAgents智能分析
 - 分析引擎: {result.llm_insights.get('model_used', 'TradingAgents')}
 - 分析时间: {result.llm_insights.get('timestamp', 'unknown')}
@@ -1236,17 +1950,19 @@ class BatchStockLLMAnalyzer:
 
 **专业分析结果:**
 {result.llm_insights.get('insights', '无分析数据')}
-"""
+""")
             else:
-                report += "- ⚠️ 未生成TradingAgents分析\n"
+                buf.write("- ⚠️ 未生成TradingAgents分析\n")
         
-        return report
+        return buf.getvalue()
     
-    def _generate_individual_stock_markdown(self, result: StockAnalysisResult) -> str:
+    def _generate_individual_stock_markdown(self, result: StockAnalysisResult,
+                                            now: Optional[datetime] = None) -> str:
         """生成单个股票的Markdown报告"""
+        now = now or datetime.now()
         analysis_time = datetime.fromisoformat(result.analysis_time)
         
-        markdown = f"""# {result.symbol} 股票分析报告
+        parts = [f"""# {result.symbol} 股票分析报告
 
 ## 📊 基本信息
 
@@ -1259,37 +1975,38 @@ class BatchStockLLMAnalyzer:
 
 ## 📈 价格统计
 
-"""
+"""]
         
         # 添加价格统计信息
         if result.price_stats:
-            markdown += "| 指标 | 数值 |\n|------|------|\n"
+            parts.append("| 指标 | 数值 |\n|------|------|\n")
             for key, value in result.price_stats.items():
                 if isinstance(value, (int, float)):
                     if 'price' in key.lower() or 'price' in key:
-                        markdown += f"| **{key}** | {value:.2f} |\n"
+                        parts.append(f"| **{key}** | {value:.2f} |\n")
                     else:
-                        markdown += f"| **{key}** | {value:.4f} |\n"
+                        parts.append(f"| **{key}** | {value:.4f} |\n")
                 else:
-                    markdown += f"| **{key}** | {value} |\n"
+                    parts.append(f"| **{key}** | {value} |\n")
         
         # 添加TradingAgents分析结果
         if result.llm_insights and result.llm_insights.get('insights'):
-            markdown += f"""
+            parts.append(f"""
 ## 🤖 TradingAgents 智能分析
 
 ### 分析引擎信息
 - **模型**: {result.llm_insights.get('model_used', 'TradingAgents')}
 - **分析时间**: {result.llm_insights.get('timestamp', 'N/A')}
 - **Token使用**: {result.llm_insights.get('tokens_used', 0)}
+- **原始状态**: {result.llm_insights.get('raw_state_path') or '未保存'}
 
 ### 专业分析结果
 
 {result.llm_insights.get('insights', '无分析数据')}
 
-"""
+""")
         else:
-            markdown += """
+            parts.append("""
 ## ⚠️ 分析状态
 
 **TradingAgents分析未完成或失败**
@@ -1300,11 +2017,11 @@ class BatchStockLLMAnalyzer:
 - 股票数据获取失败
 - 模型服务不可用
 
-"""
+""")
         
         # 添加错误信息（如果有）
         if result.error:
-            markdown += f"""
+            parts.append(f"""
 ## ❌ 错误信息
 
 ```
@@ -1318,25 +2035,27 @@ class BatchStockLLMAnalyzer:
 3. **检查API配置**: 验证API密钥和端点配置
 4. **重试分析**: 稍后重新运行分析
 
-"""
+""")
         
         # 添加页脚
-        markdown += f"""
+        parts.append(f"""
 ---
 
-*报告生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}*  
+*报告生成时间: {now.strftime('%Y-%m-%d %H:%M:%S')}*  
 *分析引擎: TradingAgents-CN*  
 *股票代码: {result.symbol}*
-"""
+""")
         
-        return markdown
+        return "".join(parts)
     
-    def _generate_batch_summary_markdown(self, batch_result: BatchAnalysisResult) -> str:
+    def _generate_batch_summary_markdown(self, batch_result: BatchAnalysisResult,
+                                         now: Optional[datetime] = None) -> str:
         """生成批量分析汇总的Markdown报告"""
+        now = now or datetime.now()
         analysis_time = datetime.fromisoformat(batch_result.timestamp)
         success_rate = batch_result.successful_analyses / batch_result.total_symbols * 100
         
-        markdown = f"""# 批量股票分析汇总报告
+        parts = [f"""# 批量股票分析汇总报告
 
 ## 📊 分析概览
 
@@ -1352,16 +2071,16 @@ class BatchStockLLMAnalyzer:
 
 ## 📈 市场分布
 
-"""
+"""]
         
         # 添加市场分布
         if batch_result.summary.get('market_distribution'):
-            markdown += "| 市场类型 | 股票数量 |\n|----------|----------|\n"
+            parts.append("| 市场类型 | 股票数量 |\n|----------|----------|\n")
             for market, count in batch_result.summary['market_distribution'].items():
-                markdown += f"| **{market}** | {count} |\n"
+                parts.append(f"| **{market}** | {count} |\n")
         
         # 添加统计信息
-        markdown += f"""
+        parts.append(f"""
 ## 📊 统计信息
 
 - **平均波动率**: {batch_result.summary.get('average_volatility', 0):.4f}
@@ -1369,71 +2088,42 @@ class BatchStockLLMAnalyzer:
 
 ## 📋 分析结果列表
 
-"""
+""")
         
         # 添加每个股票的分析结果
         for i, result in enumerate(batch_result.results, 1):
             status = "✅ 成功" if not result.error else "❌ 失败"
-            markdown += f"{i}. **{result.symbol}** ({result.market_type}) - {status}\n"
+            parts.append(f"{i}. **{result.symbol}** ({result.market_type}) - {status}\n")
             if result.error:
-                markdown += f"   - 错误: {result.error}\n"
-            markdown += "\n"
+                parts.append(f"   - 错误: {result.error}\n")
+            parts.append("\n")
         
         # 添加价格区间信息
         if batch_result.summary.get('top_price_ranges'):
-            markdown += """
+            parts.append("""
 ## 💰 价格区间排行
 
 | 股票代码 | 最低价 | 最高价 |
 |----------|--------|--------|
-"""
+""")
             for price_range in batch_result.summary['top_price_ranges']:
-                markdown += f"| {price_range['symbol']} | {price_range['min']:.2f} | {price_range['max']:.2f} |\n"
+                parts.append(f"| {price_range['symbol']} | {price_range['min']:.2f} | {price_range['max']:.2f} |\n")
         
         # 添加页脚
-        markdown += f"""
+        parts.append(f"""
 ---
 
-*报告生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}*  
+*报告生成时间: {now.strftime('%Y-%m-%d %H:%M:%S')}*  
 *分析引擎: TradingAgents-CN*  
 *批量分析ID: {batch_result.timestamp}*
-"""
+""")
         
-        return markdown
-    
-    def _make_serializable(self, obj):
-        """将对象转换为可JSON序列化的格式"""
-        if isinstance(obj, dict):
-            return {key: self._make_serializable(value) for key, value in obj.items()}
-        elif isinstance(obj, list):
-            return [self._make_serializable(item) for item in obj]
-        elif hasattr(obj, '__dict__'):
-            # 处理自定义对象
-            if hasattr(obj, 'content') and hasattr(obj, 'type'):
-                # 处理消息对象
-                return {
-                    'type': getattr(obj, 'type', 'unknown'),
-                    'content': getattr(obj, 'content', str(obj))
-                }
-            else:
-                # 处理其他对象
-                return str(obj)
-        elif hasattr(obj, 'isoformat'):
-            # 处理datetime对象
-            return obj.isoformat()
-        else:
-            # 处理基本类型
-            try:
-                json.dumps(obj)
-                return obj
-            except (TypeError, ValueError):
-                return str(obj)
+        return "".join(parts)
 
 
 def load_config(config_file: str) -> Dict[str, Any]:
     """加载配置文件"""
-    with open(config_file, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    return read_json_file(config_file)
 
 
 def main():
@@ -1449,6 +2139,8 @@ def main():
                        help='配置文件路径 (默认: scripts/batch_stock_config.json)')
     parser.add_argument('--stock-list', '-l', help='使用配置文件中的预设股票组合名称')
     parser.add_argument('--list-stocks', action='store_true', help='显示可用的股票组合列表')
+    parser.add_argument('--no-cache', action='store_true', help='不使用分析结果缓存，强制重新分析')
+    parser.add_argument('--resume', action='store_true', help='跳过 results.ndjson 中今日已成功分析的股票')
     parser.add_argument('--verbose', '-v', action='store_true', help='详细输出')
     
     args = parser.parse_args()
@@ -1522,6 +2214,13 @@ def main():
         # 将batch_settings合并到analysis_options中
         if batch_settings:
             analysis_options = {**analysis_options, 'batch_settings': batch_settings}
+        if args.no_cache:
+            analysis_options = {
+                **analysis_options,
+                'cache': {**analysis_options.get('cache', {}), 'enabled': False}
+            }
+        if args.resume:
+            analysis_options = {**analysis_options, 'resume': True}
         
         # 从顶层获取email配置
         email_config = config_data.get('email', {})
@@ -1543,6 +2242,9 @@ def main():
         print(f"⏱️ 耗时: {result.duration:.2f}s")
         print(f"📄 结果保存在: {args.output}")
         
+    except ConfigError as e:
+        logger.error(f"❌ 配置错误，未开始分析: {e}")
+        sys.exit(1)
     except Exception as e:
         logger.error(f"❌ 批量分析失败: {e}")
         sys.exit(1)
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+批量股票分析脚本测试
+测试限流速率控制、分析结果缓存、断点续跑、图初始化失败、JSON结果写入
+"""
+
+import sys
+import tempfile
+import time
+import types
+from datetime import datetime, timedelta
+from pathlib import Path
+from unittest import mock
+
+# 添加scripts目录到Python路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / 'scripts'))
+
+import batch_stock_llm_analyzer
+from batch_stock_llm_analyzer import (
+    BatchAnalysisResult, BatchStockLLMAnalyzer, ConfigError, InsightsCache, StockAnalysisConfig,
+    StockAnalysisResult, TokenBucket, TradingAgentsAnalyzer, dump_json_line,
+    write_json_file, write_json_stream
+)
+
+
+class FakeGraph:
+    """记录调用的股票并返回固定决策，代替真实的TradingAgents图"""
+
+    def __init__(self):
+        self.calls = []
+
+    def propagate(self, symbol, analysis_date):
+        self.calls.append(symbol)
+        return {'market_report': f'{symbol} report'}, {'action': 'BUY', 'confidence': 0.8, 'reasoning': 'test'}
+
+
+def make_analyzer(output_dir, symbols, **analysis_options):
+    """创建使用 FakeGraph 的批量分析器（不连接LLM，不使用缓存）"""
+    graph = FakeGraph()
+    config = StockAnalysisConfig(
+        symbols=symbols,
+        output_dir=str(output_dir),
+        llm_config={'llm_provider': 'openai', 'api_key': 'test-key', 'preflight_check': False},
+        analysis_options={
+            'cache': {'enabled': False},
+            'batch_settings': {'delay_between_requests': 0, 'max_retries': 0},
+            **analysis_options
+        }
+    )
+    with mock.patch.object(TradingAgentsAnalyzer, '_initialize_graph',
+                           lambda self: setattr(self, 'graph', graph)):
+        analyzer = BatchStockLLMAnalyzer(config)
+    return analyzer, graph
+
+
+def test_token_bucket_pacing():
+    """测试令牌桶先放行突发请求，之后按速率等待"""
+    print("🧪 测试令牌桶速率控制...")
+
+    # 每分钟600个令牌 = 每0.1秒一个，容量为2
+    bucket = TokenBucket(600, capacity=2)
+
+    start = time.monotonic()
+    assert bucket.acquire() == 0, "容量内的请求应该立即放行"
+    assert bucket.acquire() == 0, "容量内的请求应该立即放行"
+    assert time.monotonic() - start < 0.05, "突发请求不应等待"
+
+    waited = bucket.acquire()
+    elapsed = time.monotonic() - start
+    assert waited > 0, "超出容量后应该等待"
+    assert 0.08 <= elapsed < 0.5, f"应该等待约0.1秒，实际 {elapsed:.3f}s"
+
+    print("✅ 令牌桶速率控制测试通过")
+
+
+def test_token_bucket_validation():
+    """测试无效的速率和容量会被拒绝（否则 acquire 永远不会返回）"""
+    print("🧪 测试令牌桶参数校验...")
+
+    for rate, capacity in [(0, None), (-10, None), (60, 0), (60, 0.5)]:
+        try:
+            TokenBucket(rate, capacity=capacity)
+        except ValueError:
+            continue
+        raise AssertionError(f"速率 {rate}、容量 {capacity} 应该抛出 ValueError")
+
+    # 默认容量等于每分钟令牌数，但至少为1
+    assert TokenBucket(0.5).capacity == 1, "默认容量至少为1"
+
+    print("✅ 令牌桶参数校验测试通过")
+
+
+def test_insights_cache_ttl():
+    """测试缓存在有效期内命中，过期后失效"""
+    print("🧪 测试分析缓存有效期...")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache = InsightsCache(Path(temp_dir), intraday_ttl_hours=1, historical_ttl_days=30)
+
+        today = datetime.now().strftime('%Y-%m-%d')
+        last_week = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
+        assert cache.ttl_for(today) == 3600, "当日结果应使用较短有效期"
+        assert cache.ttl_for(last_week) == 30 * 86400, "历史结果应使用较长有效期"
+
+        key = InsightsCache.make_key(symbol='AAPL', date=today, model='test')
+        assert key == InsightsCache.make_key(model='test', date=today, symbol='AAPL'), "缓存键不应依赖参数顺序"
+        assert cache.get(key) is None, "未写入时不应命中"
+
+        cache.set(key, {'insights': 'ok'}, ttl=cache.ttl_for(today))
+        assert cache.get(key) == {'insights': 'ok'}, "有效期内应该命中"
+
+        cache.set(key, {'insights': 'stale'}, ttl=0.01)
+        time.sleep(0.05)
+        assert cache.get(key) is None, "过期后不应命中"
+
+    print("✅ 分析缓存有效期测试通过")
+
+
+def test_insights_cache_atomic_write():
+    """测试缓存先写临时文件再替换，写入失败时保留旧内容"""
+    print("🧪 测试分析缓存原子写入...")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache = InsightsCache(Path(temp_dir))
+        key = InsightsCache.make_key(symbol='AAPL')
+
+        cache.set(key, {'insights': 'old'})
+        assert [p.name for p in Path(temp_dir).iterdir()] == [f"{key}.json"], "写入后不应残留临时文件"
+
+        with mock.patch.object(batch_stock_llm_analyzer.os, 'replace', side_effect=OSError("disk full")):
+            cache.set(key, {'insights': 'new'})
+
+        assert cache.get(key) == {'insights': 'old'}, "替换失败时应保留旧的缓存内容"
+        assert not list(Path(temp_dir).glob('*.tmp')), "替换失败时应删除临时文件"
+
+        # 损坏的缓存文件视为未命中
+        (Path(temp_dir) / f"{key}.json").write_text('{"timestamp": ', encoding='utf-8')
+        assert cache.get(key) is None, "损坏的缓存文件不应命中"
+
+    print("✅ 分析缓存原子写入测试通过")
+
+
+def test_resume_skips_only_todays_successes():
+    """测试 --resume 只跳过今天成功完成的股票，失败的和往日的结果会重新分析"""
+    print("🧪 测试断点续跑...")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        now = datetime.now()
+        yesterday = now - timedelta(days=1)
+
+        def record(symbol, analysis_time, error=None):
+            return dump_json_line(StockAnalysisResult(
+                symbol=symbol, market_type='美股', analysis_time=analysis_time.isoformat(),
+                data_period={}, price_stats={}, error=error
+            ))
+
+        results_file = Path(temp_dir) / 'results.ndjson'
+        with open(results_file, 'wb') as f:
+            f.write(record('AAPL', now))
+            f.write(record('MSFT', now, error='boom'))
+            f.write(record('TSLA', yesterday))
+            f.write(b'{"symbol": "NVDA", "analysis_ti')  # 进程中断时写了一半的行
+
+        analyzer, graph = make_analyzer(temp_dir, ['AAPL', 'MSFT', 'TSLA', 'NVDA'], resume=True)
+        assert list(analyzer._load_completed_results()) == ['AAPL'], "只应恢复今天成功的结果"
+
+        batch_result = analyzer.run_batch_analysis()
+        assert sorted(graph.calls) == ['MSFT', 'NVDA', 'TSLA'], f"已完成的股票不应重新分析: {graph.calls}"
+        assert [r.symbol for r in batch_result.results] == ['AAPL', 'MSFT', 'TSLA', 'NVDA'], "结果应保持输入顺序"
+        assert batch_result.successful_analyses == 4, "恢复的结果应计入成功数"
+
+    print("✅ 断点续跑测试通过")
+
+
+def test_graph_init_failure_raises_config_error():
+    """测试TradingAgents图创建失败时直接报配置错误，而不是把每只股票都当作成功"""
+    print("🧪 测试图初始化失败...")
+
+    class BrokenGraph:
+        def __init__(self, *args, **kwargs):
+            raise ValueError("Unsupported LLM provider: nope")
+
+    fake_module = types.ModuleType('tradingagents.graph.trading_graph')
+    fake_module.TradingAgentsGraph = BrokenGraph
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config = StockAnalysisConfig(
+            symbols=['AAPL', 'MSFT'],
+            output_dir=temp_dir,
+            llm_config={'llm_provider': 'nope', 'api_key': 'test-key'},
+            analysis_options={'cache': {'enabled': False}}
+        )
+        with mock.patch.dict(sys.modules, {'tradingagents.graph.trading_graph': fake_module}):
+            try:
+                BatchStockLLMAnalyzer(config)
+            except ConfigError as e:
+                assert isinstance(e.__cause__, ValueError), "应保留原始异常"
+            else:
+                raise AssertionError("图创建失败时应该抛出 ConfigError")
+
+        assert not (Path(temp_dir) / 'results.ndjson').exists(), "配置错误时不应开始分析"
+
+    print("✅ 图初始化失败测试通过")
+
+
+def test_write_json_stream_matches_write_json_file():
+    """测试逐项写入的JSON与一次性写入的JSON逐字节一致"""
+    print("🧪 测试JSON流式写入...")
+
+    now = datetime.now()
+    results = [
+        StockAnalysisResult(
+            symbol='600519', market_type='A股', analysis_time=now.isoformat(),
+            data_period={'start': '2024-01-01', 'end': now},
+            price_stats={'avg_price': 1688.5, 'price_range': {'min': 1500, 'max': 1800}},
+            llm_insights={'insights': '## 贵州茅台\n\n- 看多\n- "引号" 与 \\ 反斜杠', 'tokens_used': 0}
+        ),
+        StockAnalysisResult(
+            symbol='AAPL', market_type='美股', analysis_time=now.isoformat(),
+            data_period={}, price_stats={}, error='boom'
+        ),
+    ]
+    batch_result = BatchAnalysisResult(
+        timestamp=now.isoformat(), total_symbols=2, successful_analyses=1, failed_analyses=1,
+        results=results, summary={'market_distribution': {'A股': 1}, 'top_price_ranges': []},
+        duration=12.5
+    )
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name, obj in [('batch', batch_result), ('dict', {'results': [], 'nested': {'a': [1, {'b': []}]}}),
+                          ('empty', {})]:
+            stream_file = Path(temp_dir) / f"{name}_stream.json"
+            file_file = Path(temp_dir) / f"{name}_file.json"
+            write_json_stream(stream_file, obj)
+            write_json_file(file_file, obj)
+            assert stream_file.read_bytes() == file_file.read_bytes(), f"{name}: 流式写入结果应与 write_json_file 一致"
+
+    print("✅ JSON流式写入测试通过")
+
+
+def test_lazy_module_attributes():
+    """测试原先在模块顶层导入的名称仍可访问，且在首次访问时才导入"""
+    print("🧪 测试延迟导入的模块属性...")
+
+    assert batch_stock_llm_analyzer.MIMEText.__name__ == 'MIMEText', "MIMEText 应可访问"
+    if batch_stock_llm_analyzer.OPENAI_AVAILABLE:
+        import openai
+        assert batch_stock_llm_analyzer.OpenAI is openai.OpenAI, "OpenAI 应指向 openai.OpenAI"
+
+    try:
+        batch_stock_llm_analyzer.NotAnAttribute
+    except AttributeError:
+        pass
+    else:
+        raise AssertionError("不存在的属性应该抛出 AttributeError")
+
+    print("✅ 延迟导入的模块属性测试通过")
+
+
+def main():
+    """主测试函数"""
+    print("🧪 批量股票分析脚本测试")
+    print("=" * 60)
+
+    try:
+        test_token_bucket_pacing()
+        test_token_bucket_validation()
+        test_insights_cache_ttl()
+        test_insights_cache_atomic_write()
+        test_resume_skips_only_todays_successes()
+        test_graph_init_failure_raises_config_error()
+        test_write_json_stream_matches_write_json_file()
+        test_lazy_module_attributes()
+
+        print("\n🎉 所有测试通过！")
+        return True
+
+    except Exception as e:
+        print(f"\n❌ 测试失败: {e}")
+        import traceback
+        print(f"错误详情: {traceback.format_exc()}")
+        return False
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)